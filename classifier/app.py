@@ -3,18 +3,41 @@ import os
 from datetime import datetime
 import requests
 from apscheduler.schedulers.background import BackgroundScheduler
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from flask import Flask
+from flask import Flask, jsonify
 from ollama import Client, ChatResponse
 from pydantic import BaseModel
 from enum import Enum
 import re
 from multiprocessing import Process, Queue
+from prefetch import Prefetcher
+from article_mirror import ArticleMirror
+from work_queue import CLASSIFY, WorkQueue
+from prefilter import Prefilter
+from job_runner import JobRunner
+import threading
 
 
 AI_SCORE = "AIScore4"
 model = "gemma3:12b"
+# "on" runs each stage on its smaller model first and escalates to `model` when the answer fails validation
+CASCADE = os.getenv("CLASSIFIER_CASCADE", "off")
+CASCADE_MODELS = {
+    "extraction": os.getenv("CLASSIFIER_EXTRACTION_MODEL", "gemma3:4b"),
+    "score": os.getenv("CLASSIFIER_SCORE_MODEL", "gemma3:1b"),
+    "justification": os.getenv("CLASSIFIER_JUSTIFICATION_MODEL", "gemma3:4b"),
+}
+# Answers sampled from the small model per call; any disagreement between them escalates
+CASCADE_AGREEMENT_SAMPLES = int(os.getenv("CLASSIFIER_AGREEMENT_SAMPLES", "2"))
+PAGE_SIZE = 10
+PREFETCH_WORKERS = 4
+# "on" scores confidently irrelevant articles without the LLM, "off" sends every article to the rubric
+PREFILTER = os.getenv("CLASSIFIER_PREFILTER", "off")
+PREFILTER_PATH = "/app/output/prefilter.joblib"
+PREFILTER_TRAINING_LIMIT = 20000
+# Translator service that translates deferred article content on request (TRANSLATION_MODE=lazy)
+TRANSLATOR_URL = os.getenv("TRANSLATOR_URL")
+ARTICLE_FIELDS = "Id,originalTitle,translatedTitle,originalContent,translatedContent,originalOutlet,translatedOutlet,isEnglish,originalLanguage,articleUrl,webScrapedContent,contentTranslationDeferred"
 
 country_list = [
     'Afghanistan',
@@ -393,11 +416,17 @@ def summarize_chunk(text):
     return response['message']['content']
 
 
-def getExtraction(prompt, extractionPrompt, content, OutputClass):
+def getExtraction(prompt, extractionPrompt, content, OutputClass, stage=None):
+    if CASCADE == "on" and stage in CASCADE_MODELS:
+        return cascade(prompt, extractionPrompt, content, OutputClass, stage)
+    return chat(prompt, extractionPrompt, content, OutputClass, model)
+
+
+def chat(prompt, extractionPrompt, content, OutputClass, model_name):
     response: ChatResponse = run_with_timeout(
         client.chat,
         120,
-        model=model,
+        model=model_name,
         messages=[
             {'role': 'system', 'content': prompt},
             {'role': 'system', 'content': extractionPrompt},
@@ -409,138 +438,388 @@ def getExtraction(prompt, extractionPrompt, content, OutputClass):
     return response
 
 
+cascade_stats = {stage: {"calls": 0, "escalated": 0, "reasons": {}} for stage in CASCADE_MODELS}
+cascade_lock = threading.Lock()
+
+
+def validate_answer(response, OutputClass):
+    """Returns the reason an answer cannot be used, or None when it passes."""
+    try:
+        answer = OutputClass.model_validate_json(response['message']['content'])
+    except Exception:
+        # Covers malformed JSON and a recipient outside the Country enum
+        return "invalid"
+    if isinstance(answer, LLMScore) and not 1 <= answer.score <= 5:
+        return "range"
+    return None
+
+
+def cascade(prompt, extractionPrompt, content, OutputClass, stage):
+    """
+    Asks the stage's small model, sampling it CASCADE_AGREEMENT_SAMPLES times for
+    scores and the recipient, and falls back to the full model when an answer is
+    invalid, out of range or the samples disagree.
+    """
+    samples = CASCADE_AGREEMENT_SAMPLES if OutputClass in (LLMScore, LLMExtractionA) else 1
+    reason = None
+    answers = []
+    try:
+        for _ in range(samples):
+            response = chat(prompt, extractionPrompt, content, OutputClass, CASCADE_MODELS[stage])
+            reason = validate_answer(response, OutputClass)
+            if reason:
+                break
+            answers.append(json.loads(response['message']['content']))
+        if reason is None and any(answer != answers[0] for answer in answers):
+            reason = "agreement"
+    except Exception:
+        reason = "error"
+
+    with cascade_lock:
+        stats = cascade_stats[stage]
+        stats["calls"] += 1
+        if reason:
+            stats["escalated"] += 1
+            stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+    if reason:
+        return chat(prompt, extractionPrompt, content, OutputClass, model)
+    return response
+
+
+def report_cascade():
+    if CASCADE != "on":
+        return
+    with cascade_lock:
+        for stage, stats in cascade_stats.items():
+            if stats["calls"]:
+                rate = stats["escalated"] / stats["calls"]
+                print(f"[MOF Classifier] {stage}: escalated {stats['escalated']} of {stats['calls']} calls ({rate:.1%}) {stats['reasons']}")
+
+
+@app.route('/cascade')
+def cascade_status():
+    with cascade_lock:
+        return jsonify({"enabled": CASCADE == "on", "models": CASCADE_MODELS, "escalation_model": model, "stages": cascade_stats})
+
+
+@app.route('/queue')
+def queue_status():
+    queue = WorkQueue.open()
+    if queue is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **queue.stats(CLASSIFY)})
+
+
 @app.route('/health')
 def health_check():
     return 'healthy'
 
 
-def getText(url):
-    print("[MOF Classifier] Loading URL: " + url)
+def classify(offset=0, job=None):
+    print("[MOF Classifier] Classifying started at " + datetime.now().isoformat() + " with offset of: " + str(offset) + "\n")
+    prefetcher = Prefetcher(workers=PREFETCH_WORKERS, flush_size=PAGE_SIZE)
+    mirror = ArticleMirror.open()
+    if job:
+        job.set_total(count_unscored(mirror))
     try:
-        response = requests.get(url, timeout=10)
+        _classify(offset, prefetcher, mirror, load_prefilter(mirror), job)
+    finally:
+        prefetcher.shutdown()
+
+
+def count_unscored(mirror=None):
+    if mirror:
+        return mirror.count(f"{AI_SCORE} IS NULL AND isEnglish = 1")
+    db_url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    params = {"fields": "Id", "where": f"({AI_SCORE},is,null)~and(isEnglish,eq,true)", "limit": 1}
+    return requests.get(db_url, headers=headers, params=params).json().get("pageInfo").get("totalRows")
+
+
+def fetch_scored(mirror=None):
+    fields = ARTICLE_FIELDS + f",{AI_SCORE},{AI_SCORE}_Justification"
+    if mirror:
+        return mirror.query(f"{AI_SCORE} >= 0", limit=PREFILTER_TRAINING_LIMIT, fields=fields)
+    db_url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    articles = []
+    while len(articles) < PREFILTER_TRAINING_LIMIT:
+        params = {"fields": fields, "where": f"({AI_SCORE},gte,0)", "offset": len(articles), "limit": 1000}
+        page = requests.get(db_url, headers=headers, params=params).json().get("list")
+        if not page:
+            break
+        articles.extend(page)
+    return articles
+
+
+def load_prefilter(mirror=None):
+    if PREFILTER != "on":
+        return None
+    prefilter = Prefilter.load_or_train(PREFILTER_PATH, lambda: fetch_scored(mirror))
+    # Without a trained model nothing is scored by the prefilter
+    return prefilter if prefilter.model is not None else None
+
+
+def apply_prefilter(articles, prefilter, mirror=None):
+    """Scores confidently irrelevant articles without the LLM and returns the rest."""
+    if prefilter is None:
+        return articles
+    remaining = []
+    for article in articles:
+        # Short articles are judged on their scraped page, which is only fetched for the rubric
+        if Prefetcher.needs_text(article):
+            remaining.append(article)
+            continue
+        justification = prefilter.check(article)
+        if justification is None:
+            remaining.append(article)
+            continue
+        article[AI_SCORE] = 1
+        article[f"{AI_SCORE}_Justification"] = justification
+        save_article(article, mirror)
+    if len(remaining) < len(articles):
+        print(f"[MOF Classifier] Prefilter scored {len(articles) - len(remaining)} of {len(articles)} articles without the LLM")
+    return remaining
+
+
+def fetch_unscored(offset, limit, mirror=None):
+    if mirror:
+        return mirror.query(
+            f"{AI_SCORE} IS NULL AND isEnglish = 1", order="articlePublishDateEst DESC",
+            limit=limit, offset=offset, fields=ARTICLE_FIELDS,
+        )
+    db_url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    params = {
+        "fields": ARTICLE_FIELDS,
+        "where": f"({AI_SCORE},is,null)~and(isEnglish,eq,true)",
+        "offset": offset,
+        "limit": limit,
+        "sort": "-articlePublishDateEst",
+    }
+    return requests.get(db_url, headers=headers, params=params).json().get("list")
+
+
+def fetch_unscored_ids(mirror=None):
+    if mirror:
+        return [row["Id"] for row in mirror.query(f"{AI_SCORE} IS NULL AND isEnglish = 1", order="Id", fields="Id")]
+    db_url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    ids = []
+    while True:
+        # Walked by Id, since the consumer scores articles out of the filter while this runs
+        params = {
+            "fields": "Id",
+            "where": f"({AI_SCORE},is,null)~and(isEnglish,eq,true)~and(Id,gt,{ids[-1] if ids else 0})",
+            "sort": "Id",
+            "limit": 1000,
+        }
+        page = requests.get(db_url, headers=headers, params=params).json().get("list")
+        if not page:
+            return ids
+        ids.extend(row["Id"] for row in page)
+
+
+def fetch_unscored_by_id(ids, mirror=None):
+    if mirror:
+        where = f"Id IN ({','.join('?' for _ in ids)}) AND {AI_SCORE} IS NULL"
+        return mirror.query(where, ids, fields=ARTICLE_FIELDS)
+    db_url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    params = {
+        "fields": ARTICLE_FIELDS,
+        "where": f"({AI_SCORE},is,null)~and(" + "~or".join(f"(Id,eq,{article_id})" for article_id in ids) + ")",
+        "limit": len(ids),
+    }
+    return requests.get(db_url, headers=headers, params=params).json().get("list")
+
+
+def save_article(article, mirror=None):
+    db_url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    if mirror:
+        # Also updates the local row, so the article drops out of the next unscored page
+        return mirror.write_through(db_url, headers, article)
+    return requests.patch(db_url, headers=headers, json=article)
+
+
+def request_translation(article):
+    """Asks the translator for content it deferred; returns None when the request fails."""
+    try:
+        response = requests.post(f"{TRANSLATOR_URL}/translate/{article['Id']}", timeout=120)
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            text = soup.get_text()
-            return re.sub(r"\s+", " ", text).strip()
-        else:
-            return None
+            # An empty string when the content needed no translation
+            return response.json().get("translatedContent") or ""
+        print(f"[MOF Classifier] Translation request failed for article {article['Id']}: {response.status_code}")
     except Exception as e:
-        print(f"[MOF Classifier] Error loading URL: {e}")
-        return None
+        print(f"[MOF Classifier] Translation request failed for article {article['Id']}: {e}")
+    return None
 
 
-def classify(offset=0):
-    print("[MOF Classifier] Classifying started at " + datetime.now().isoformat() + " with offset of: " + str(offset) + "\n")
+def classify_article(article, prefetcher, mirror=None):
+    if TRANSLATOR_URL and article.get("contentTranslationDeferred"):
+        translated = request_translation(article)
+        if translated is not None:
+            article["translatedContent"] = translated
+            article["contentTranslationDeferred"] = False
 
+    MAX_ATTEMPTS = 2
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            print("[MOF Classifier] Classifying article: " + article["originalTitle"])
+            llm_title = article["translatedTitle"] if article.get("translatedTitle") else article["originalTitle"]
+            llm_content = article["translatedContent"] if article.get("translatedContent") else article["originalContent"]
+            if len(llm_content) < 1000:
+                if( article["webScrapedContent"] == None):
+                    print("[MOF Classifier] Article too short. Scraping ...")
+                    article["webScrapedContent"] = prefetcher.get(article)
+            llm_content = article["webScrapedContent"] if article["webScrapedContent"] != None else llm_content
+            llm_prompt = f"Headline: {llm_title}\n\nBody: {llm_content}"
+
+            if (len(llm_prompt) > 10000):
+                o_len = len(llm_prompt)
+                print("[MOF Classifier] Article too long. Condensing ...")
+                llm_prompt = condense_article(llm_prompt)
+                n_len = len(llm_prompt)
+                print(f"[MOF Classifier] Condensed prompt by {o_len - n_len} characters")
+
+            print(f"[MOF Classifier] Prompt length: {len(llm_prompt)}")
+            print(f"[MOF Classifier] Extracting a information ...")
+            a_extraction_response = getExtraction(prompt, prompt_a_extraction, llm_prompt, LLMExtractionA, "extraction")
+            print(f"[MOF Classifier] Extracting b information ...")
+            b_extraction_response = getExtraction(prompt, prompt_b_extraction, llm_prompt, LLMExtractionB, "extraction")
+            print(f"[MOF Classifier] Extracting c information ...")
+            c_extraction_response = getExtraction(prompt, prompt_c_extraction, llm_prompt, LLMExtractionC, "extraction")
+            print(f"[MOF Classifier] Extracting d information ...")
+            d_extraction_response = getExtraction(prompt, prompt_d_extraction, llm_prompt, LLMExtractionD, "extraction")
+            print("[MOF Classifier] Extraction complete")
+            article['a'] = json.loads(str(a_extraction_response['message']['content']))['recipient']
+            article['b'] = json.loads(str(b_extraction_response['message']['content']))['chinese_institution']
+            article['c'] = json.loads(str(c_extraction_response['message']['content']))['financial_instrument']
+            article['d'] = json.loads(str(d_extraction_response['message']['content']))['project_or_activity']
+            print("[MOF Classifier] A extraction response: " + article['a'])
+            print("[MOF Classifier] B extraction response: " + article['b'])
+            print("[MOF Classifier] C extraction response: " + article['c'])
+            print("[MOF Classifier] D extraction response: " + article['d'])
+            a_score_prompt = f"A. Recipient\n{article['a']}"
+            a_score_response = getExtraction(prompt, prompt_a_score, a_score_prompt, LLMScore, "score")
+            b_score_prompt = f"B. Chinese Lender\n{article['b']}"
+            b_score_response = getExtraction(prompt, prompt_b_score, b_score_prompt, LLMScore, "score")
+            c_score_prompt = f"C. Financial Instrument\n{article['c']}"
+            c_score_response = getExtraction(prompt, prompt_c_score, c_score_prompt, LLMScore, "score")
+            d_score_prompt = f"D. Activity Precision\n{article['d']}"
+            d_score_response = getExtraction(prompt, prompt_d_score, d_score_prompt, LLMScore, "score")
+
+            article[f"{AI_SCORE}_a"] = int(json.loads(a_score_response['message']['content'])['score'])
+            article[f"{AI_SCORE}_b"] = int(json.loads(b_score_response['message']['content'])['score'])
+            article[f"{AI_SCORE}_c"] = int(json.loads(c_score_response['message']['content'])['score'])
+            article[f"{AI_SCORE}_d"] = int(json.loads(d_score_response['message']['content'])['score'])
+
+            print("[MOF Classifier] A score: " + str(article[f"{AI_SCORE}_a"]))
+            print("[MOF Classifier] B score: " + str(article[f"{AI_SCORE}_b"]))
+            print("[MOF Classifier] C score: " + str(article[f"{AI_SCORE}_c"]))
+            print("[MOF Classifier] D score: " + str(article[f"{AI_SCORE}_d"]))
+
+            if article[f"{AI_SCORE}_a"] > 5 or article[f"{AI_SCORE}_b"] > 5 or article[f"{AI_SCORE}_c"] > 5 or article[f"{AI_SCORE}_d"] > 5:
+                raise Exception("Invalid score")
+
+            article[AI_SCORE] = (article[f"{AI_SCORE}_a"] + article[f"{AI_SCORE}_b"] + article[f"{AI_SCORE}_c"] + article[f"{AI_SCORE}_d"]) / 4
+
+            justificationPrompt = (
+               f"A: {article['a']}: Score{article[f'{AI_SCORE}_a']}\n" +
+               f"B: {article['b']}: Score{article[f'{AI_SCORE}_b']}\n" +
+               f"C: {article['c']}: Score{article[f'{AI_SCORE}_c']}\n" +
+               f"D: {article['d']}: Score{article[f'{AI_SCORE}_d']}")
+
+            response = getExtraction(prompt, "Please provided justification", justificationPrompt, LLMOutput, "justification")
+            response = json.loads(response['message']['content'])
+            justification = response['justification']
+            article[f"{AI_SCORE}_Justification"] = justification
+            save_article(article, mirror)
+            break
+        except Exception as e:
+            print(e)
+            print(f"[MOF Classifier] Request timeout. On attempt: {attempt}")
+            if attempt == MAX_ATTEMPTS:
+                article[AI_SCORE] = -2
+                article[f"{AI_SCORE}_Justification"] = "Error: " + str(e)
+                save_article(article, mirror)
+
+
+def _classify(offset, prefetcher, mirror=None, prefilter=None, job=None):
     while True:
-        db_url = os.getenv("NOCO_DB_URL")
-        headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
-        params = {
-            "fields": "Id,originalTitle,translatedTitle,originalContent,translatedContent,originalOutlet,translatedOutlet,isEnglish,originalLanguage,articleUrl,webScrapedContent",
-            "where": f"({AI_SCORE},is,null)~and(isEnglish,eq,true)",
-            "offset": offset,
-            "limit": 10,
-            "sort": "-articlePublishDateEst",
-        }
-        articles = requests.get(db_url, headers=headers, params=params)
-        articles = articles.json()
+        # Fetch the next page as well so its web content downloads while this page is classified
+        articles = fetch_unscored(offset, PAGE_SIZE * 2, mirror)
 
-        if articles.get("pageInfo").get("totalRows") == 0:
+        if len(articles) == 0:
             print("[MOF Classifier] No articles to classify")
             return
 
-        for article in articles.get("list"):
-            MAX_ATTEMPTS = 2
-            for attempt in range(1, MAX_ATTEMPTS + 1):
-                try:
-                    print("[MOF Classifier] Classifying article: " + article["originalTitle"])
-                    llm_title = article["translatedTitle"] if article.get("translatedTitle") else article["originalTitle"]
-                    llm_content = article["translatedContent"] if article.get("translatedContent") else article["originalContent"]
-                    if len(llm_content) < 1000:
-                        if( article["webScrapedContent"] == None):
-                            print("[MOF Classifier] Article too short. Scraping ...")
-                            article["webScrapedContent"] = getText(article["articleUrl"])
-                    llm_content = article["webScrapedContent"] if article["webScrapedContent"] != None else llm_content
-                    llm_prompt = f"Headline: {llm_title}\n\nBody: {llm_content}"
-
-                    if (len(llm_prompt) > 10000):
-                        o_len = len(llm_prompt)
-                        print("[MOF Classifier] Article too long. Condensing ...")
-                        llm_prompt = condense_article(llm_prompt)
-                        n_len = len(llm_prompt)
-                        print(f"[MOF Classifier] Condensed prompt by {o_len - n_len} characters")
-
-                    print(f"[MOF Classifier] Prompt length: {len(llm_prompt)}")
-                    print(f"[MOF Classifier] Extracting a information ...")
-                    a_extraction_response = getExtraction(prompt, prompt_a_extraction, llm_prompt, LLMExtractionA)
-                    print(f"[MOF Classifier] Extracting b information ...")
-                    b_extraction_response = getExtraction(prompt, prompt_b_extraction, llm_prompt, LLMExtractionB)
-                    print(f"[MOF Classifier] Extracting c information ...")
-                    c_extraction_response = getExtraction(prompt, prompt_c_extraction, llm_prompt, LLMExtractionC)
-                    print(f"[MOF Classifier] Extracting d information ...")
-                    d_extraction_response = getExtraction(prompt, prompt_d_extraction, llm_prompt, LLMExtractionD)
-                    print("[MOF Classifier] Extraction complete")
-                    article['a'] = json.loads(str(a_extraction_response['message']['content']))['recipient']
-                    article['b'] = json.loads(str(b_extraction_response['message']['content']))['chinese_institution']
-                    article['c'] = json.loads(str(c_extraction_response['message']['content']))['financial_instrument']
-                    article['d'] = json.loads(str(d_extraction_response['message']['content']))['project_or_activity']
-                    print("[MOF Classifier] A extraction response: " + article['a'])
-                    print("[MOF Classifier] B extraction response: " + article['b'])
-                    print("[MOF Classifier] C extraction response: " + article['c'])
-                    print("[MOF Classifier] D extraction response: " + article['d'])
-                    a_score_prompt = f"A. Recipient\n{article['a']}"
-                    a_score_response = getExtraction(prompt, prompt_a_score, a_score_prompt, LLMScore)
-                    b_score_prompt = f"B. Chinese Lender\n{article['b']}"
-                    b_score_response = getExtraction(prompt, prompt_b_score, b_score_prompt, LLMScore)
-                    c_score_prompt = f"C. Financial Instrument\n{article['c']}"
-                    c_score_response = getExtraction(prompt, prompt_c_score, c_score_prompt, LLMScore)
-                    d_score_prompt = f"D. Activity Precision\n{article['d']}"
-                    d_score_response = getExtraction(prompt, prompt_d_score, d_score_prompt, LLMScore)
-
-                    article[f"{AI_SCORE}_a"] = int(json.loads(a_score_response['message']['content'])['score'])
-                    article[f"{AI_SCORE}_b"] = int(json.loads(b_score_response['message']['content'])['score'])
-                    article[f"{AI_SCORE}_c"] = int(json.loads(c_score_response['message']['content'])['score'])
-                    article[f"{AI_SCORE}_d"] = int(json.loads(d_score_response['message']['content'])['score'])
-
-                    print("[MOF Classifier] A score: " + str(article[f"{AI_SCORE}_a"]))
-                    print("[MOF Classifier] B score: " + str(article[f"{AI_SCORE}_b"]))
-                    print("[MOF Classifier] C score: " + str(article[f"{AI_SCORE}_c"]))
-                    print("[MOF Classifier] D score: " + str(article[f"{AI_SCORE}_d"]))
-
-                    if article[f"{AI_SCORE}_a"] > 5 or article[f"{AI_SCORE}_b"] > 5 or article[f"{AI_SCORE}_c"] > 5 or article[f"{AI_SCORE}_d"] > 5:
-                        raise Exception("Invalid score")
-
-                    article[AI_SCORE] = (article[f"{AI_SCORE}_a"] + article[f"{AI_SCORE}_b"] + article[f"{AI_SCORE}_c"] + article[f"{AI_SCORE}_d"]) / 4
-
-                    justificationPrompt = (
-                       f"A: {article['a']}: Score{article[f'{AI_SCORE}_a']}\n" +
-                       f"B: {article['b']}: Score{article[f'{AI_SCORE}_b']}\n" +
-                       f"C: {article['c']}: Score{article[f'{AI_SCORE}_c']}\n" +
-                       f"D: {article['d']}: Score{article[f'{AI_SCORE}_d']}")
-
-                    response = getExtraction(prompt, "Please provided justification", justificationPrompt, LLMOutput)
-                    response = json.loads(response['message']['content'])
-                    justification = response['justification']
-                    article[f"{AI_SCORE}_Justification"] = justification
-                    requests.patch(db_url, headers=headers, json=article)
-                    break
-                except Exception as e:
-                    print(e)
-                    print(f"[MOF Classifier] Request timeout. On attempt: {attempt}")
-                    if attempt == MAX_ATTEMPTS:
-                        article[AI_SCORE] = -2
-                        article[f"{AI_SCORE}_Justification"] = "Error: " + str(e)
-                        requests.patch(db_url, headers=headers, json=article)
+        fetched = len(articles)
+        articles = apply_prefilter(articles, prefilter, mirror)
+        if job:
+            job.advance(fetched - len(articles))
+
+        prefetcher.submit(articles)
+
+        for article in articles[:PAGE_SIZE]:
+            classify_article(article, prefetcher, mirror)
+            if job:
+                job.advance()
+
+        prefetcher.flush()
+        report_cascade()
+
+
+def publish_unscored(job=None):
+    """
+    With the work queue enabled, queues the unscored backlog for `consume`
+    instead of classifying it here, so no article goes to the LLM twice at once.
+    """
+    queue = WorkQueue.open()
+    ids = fetch_unscored_ids(ArticleMirror.open())
+    print(f"[MOF Classifier] Queueing {len(ids)} unscored articles")
+    if job:
+        job.set_total(len(ids))
+    for start in range(0, len(ids), PAGE_SIZE):
+        batch = ids[start:start + PAGE_SIZE]
+        queue.publish(CLASSIFY, batch)
+        if job:
+            job.advance(len(batch))
+
+
+def consume(queue):
+    """Classifies articles as the translator publishes them."""
+    mirror = ArticleMirror.open()
+    prefetcher = Prefetcher(workers=PREFETCH_WORKERS, flush_size=PAGE_SIZE)
+    prefilter = load_prefilter(mirror)
+    while True:
+        jobs = queue.wait(CLASSIFY, PAGE_SIZE)
+        # Unacked jobs are handed out again after the visibility timeout
+        try:
+            articles = fetch_unscored_by_id([article_id for _, article_id in jobs], mirror)
+            articles = apply_prefilter(articles, prefilter, mirror)
+            prefetcher.submit(articles)
+            for article in articles:
+                classify_article(article, prefetcher, mirror)
+            prefetcher.flush()
+            report_cascade()
+            queue.ack(jobs)
+        except Exception as e:
+            print(f"[MOF Classifier] Error: {e}")
 
 
 if __name__ == '__main__':
     print(f"Updating {AI_SCORE}")
     load_dotenv()
-    #scheduler.add_job(classify, "cron", hour="*", minute="*/15", max_instances=1, args=[0])
-    #scheduler.add_job(classify, "cron", hour="*", minute="*/15", max_instances=1, args=[50])
-    #scheduler.add_job(classify, "cron", hour="*", minute="*/15", max_instances=1, args=[100])
-    #scheduler.add_job(classify, "cron", hour="*", minute="*/15", max_instances=1, args=[150])
-    #scheduler.start()
-    classify()
+    runner = JobRunner(app, scheduler)
+    queue = WorkQueue.open()
+    # With the queue, `consume` does all the classifying and the job only queues the backlog
+    runner.register("classify", publish_unscored if queue else classify)
+    #runner.schedule("classify", "cron", hour="*", minute="*/15")
+    scheduler.start()
+    runner.trigger("classify")
+    if queue:
+        threading.Thread(target=consume, args=(queue,), daemon=True).start()
     print("Classifier schedule started")
     app.run(port=5003)
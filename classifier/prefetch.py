@@ -0,0 +1,92 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import trafilatura
+from bs4 import BeautifulSoup
+
+
+def extract_text(html):
+    # Prefer the main article body; fall back to the whole page text when the
+    # boilerplate stripper cannot find one (index pages, very short articles).
+    text = trafilatura.extract(html, include_comments=False, include_tables=False)
+    if not text:
+        text = BeautifulSoup(html, "html.parser").get_text()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def fetch_text(url, session=None, timeout=10):
+    print("[MOF Classifier] Loading URL: " + url)
+    try:
+        response = (session or requests).get(url, timeout=timeout)
+        if response.status_code == 200:
+            return extract_text(response.text)
+        else:
+            return None
+    except Exception as e:
+        print(f"[MOF Classifier] Error loading URL: {e}")
+        return None
+
+
+class Prefetcher:
+    """
+    Downloads and extracts webScrapedContent for upcoming articles in the
+    background so the LLM calls never wait on the network. Extracted text is
+    written back to NocoDB in batches.
+    """
+
+    def __init__(self, workers=4, flush_size=10):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.session = requests.Session()
+        self.flush_size = flush_size
+        self.futures = {}
+        self.pending = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def needs_text(article):
+        content = article.get("translatedContent") or article.get("originalContent") or ""
+        return len(content) < 1000 and article.get("webScrapedContent") is None and bool(article.get("articleUrl"))
+
+    def submit(self, articles):
+        for article in articles:
+            article_id = article.get("Id")
+            if article_id in self.futures or not self.needs_text(article):
+                continue
+            future = self.executor.submit(fetch_text, article["articleUrl"], self.session)
+            future.add_done_callback(lambda f, article_id=article_id: self._done(article_id, f))
+            self.futures[article_id] = future
+
+    def _done(self, article_id, future):
+        text = future.result()
+        if text is None:
+            return
+        with self.lock:
+            self.pending.append({"Id": article_id, "webScrapedContent": text})
+
+    def get(self, article):
+        future = self.futures.pop(article.get("Id"), None)
+        if future is None:
+            return fetch_text(article["articleUrl"], self.session)
+        return future.result()
+
+    def flush(self, force=False):
+        with self.lock:
+            if not self.pending or (not force and len(self.pending) < self.flush_size):
+                return
+            batch, self.pending = self.pending, []
+
+        db_url = os.getenv("NOCO_DB_URL")
+        headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+        try:
+            response = requests.patch(db_url, headers=headers, json=batch)
+            if response.status_code != 200:
+                print(f"[MOF Classifier] Failed to save scraped content for {len(batch)} articles: {response.status_code}")
+        except Exception as e:
+            print(f"[MOF Classifier] Error saving scraped content: {e}")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.flush(force=True)
@@ -0,0 +1,123 @@
+import os
+import re
+import time
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+
+# Names the rubric's B criterion looks for, in English and Chinese
+LENDER_ALIASES = [
+    "exim bank", "export-import bank of china", "china exim", "cexim", "china development bank", "cdb",
+    "sinosure", "silk road fund", "bank of china", "icbc", "industrial and commercial bank of china",
+    "china construction bank", "agricultural bank of china", "chinese bank", "chinese lender",
+    "进出口银行", "国家开发银行", "国开行", "中国银行", "工商银行", "建设银行", "农业银行", "中国信保", "丝路基金",
+]
+# Financing vocabulary from the rubric's C criterion
+FINANCE_TERMS = [
+    "loan", "lend", "borrow", "debt", "credit", "financing", "finance", "concessional", "fund",
+    "贷款", "融资", "信贷", "优惠", "借款", "债务", "资金",
+]
+ALIAS_PATTERN = re.compile("|".join(rf"\b{re.escape(a)}\b" if a.isascii() else re.escape(a) for a in LENDER_ALIASES))
+FINANCE_PATTERN = re.compile("|".join(rf"\b{re.escape(t)}" if t.isascii() else re.escape(t) for t in FINANCE_TERMS))
+
+# An average rubric score at or above this counts as relevant when training
+RELEVANT_SCORE = 3
+# Articles the model gives less than this chance of being relevant are scored without the LLM;
+# articles that use financing vocabulary need a chance below a fifth of it
+IRRELEVANT_PROBABILITY = 0.05
+MIN_TRAINING_ARTICLES = 200
+MAX_MODEL_AGE_DAYS = 7
+JUSTIFICATION_PREFIX = "Prefilter:"
+
+
+def article_text(article):
+    parts = [
+        article.get("translatedTitle") or "",
+        article.get("originalTitle") or "",
+        article.get("translatedContent") or "",
+        article.get("originalContent") or "",
+        article.get("webScrapedContent") or "",
+    ]
+    return "\n".join(parts).lower()
+
+
+class Prefilter:
+    """
+    Cheap relevance check run before the LLM rubric. Articles naming a Chinese
+    lender always go to the LLM. Other articles are scored as irrelevant when a
+    model trained on past AIScore4 results gives them a low chance of being
+    relevant, with a stricter cutoff when they use financing vocabulary. Without
+    a trained model every article goes to the LLM.
+    """
+
+    vectorizer = HashingVectorizer(n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False)
+
+    def __init__(self, model=None):
+        self.model = model
+
+    @classmethod
+    def train(cls, articles):
+        """
+        Fits a logistic regression on articles already scored by the LLM. Returns a
+        prefilter without a model, which skips nothing, when there are too few of
+        them or only one class.
+        """
+        scored = [
+            a for a in articles
+            if a.get("AIScore4") is not None and a["AIScore4"] >= 0
+            and not str(a.get("AIScore4_Justification") or "").startswith(JUSTIFICATION_PREFIX)
+        ]
+        labels = np.array([a["AIScore4"] >= RELEVANT_SCORE for a in scored])
+        if len(scored) < MIN_TRAINING_ARTICLES or labels.all() or not labels.any():
+            print(f"[MOF Classifier] Only {len(scored)} scored articles, prefilter disabled until there are {MIN_TRAINING_ARTICLES}")
+            return cls()
+
+        features = cls.vectorizer.transform([article_text(a) for a in scored])
+        order = np.random.default_rng(0).permutation(len(scored))
+        split = int(len(order) * 0.8)
+        train, test = order[:split], order[split:]
+        model = LogisticRegression(class_weight="balanced", max_iter=1000)
+        model.fit(features[train], labels[train])
+
+        # Report what the prefilter would have done on held-out articles
+        prefilter = cls(model)
+        probabilities = model.predict_proba(features[test])[:, 1]
+        skipped = np.array([
+            prefilter.skip(article_text(scored[i]), p) for i, p in zip(test, probabilities)
+        ])
+        missed = int((skipped & labels[test]).sum())
+        print(
+            f"[MOF Classifier] Prefilter trained on {split} articles; on {len(test)} held out it would skip "
+            f"{skipped.mean():.1%} of the LLM calls and miss {missed} of {int(labels[test].sum())} relevant articles"
+        )
+        model.fit(features, labels)
+        return cls(model)
+
+    @classmethod
+    def load_or_train(cls, path, fetch_scored):
+        """Loads the saved prefilter, retraining it from `fetch_scored()` once it is a week old."""
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < MAX_MODEL_AGE_DAYS * 86400:
+            return cls(joblib.load(path))
+        prefilter = cls.train(fetch_scored())
+        if prefilter.model is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            joblib.dump(prefilter.model, path)
+        return prefilter
+
+    def skip(self, text, probability=None):
+        if self.model is None or ALIAS_PATTERN.search(text):
+            return False
+        finance = FINANCE_PATTERN.search(text) is not None
+        return probability < (IRRELEVANT_PROBABILITY / 5 if finance else IRRELEVANT_PROBABILITY)
+
+    def check(self, article):
+        """Returns the justification for scoring an article as irrelevant, or None to send it to the LLM."""
+        text = article_text(article)
+        probability = None
+        if self.model is not None and not ALIAS_PATTERN.search(text):
+            probability = self.model.predict_proba(self.vectorizer.transform([text]))[0, 1]
+        if not self.skip(text, probability):
+            return None
+        return f"{JUSTIFICATION_PREFIX} no Chinese lender mentioned, relevance {probability:.3f}"
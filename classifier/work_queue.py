@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import time
+
+# Copied into the service directories from shared/ by shared/sync.py; edit shared/ and re-run it.
+
+TRANSLATE = "translate"
+CLASSIFY = "classify"
+
+
+class WorkQueue:
+    """
+    Record Ids handed from one stage to the next through a SQLite file shared by
+    the services. A consumer claims a batch, processes it and acks it; claims
+    that are not acked within `visibility_timeout` seconds are handed out again,
+    so a crashed consumer loses no work. A job claimed `max_attempts` times
+    without an ack is moved to the dead_jobs table instead of being handed out
+    again. Publishing blocks while a topic holds `max_depth` or more jobs, which
+    slows the producer down to the pace of the stage after it.
+    """
+
+    def __init__(self, path, max_depth=500, visibility_timeout=900, poll_interval=2, max_attempts=5):
+        self.path = path
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.con = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, record_id INTEGER NOT NULL, "
+            "claimed_at REAL, attempts INTEGER NOT NULL DEFAULT 0, UNIQUE (topic, record_id))"
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (topic, claimed_at, id)")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS dead_jobs ("
+            "id INTEGER PRIMARY KEY, topic TEXT NOT NULL, record_id INTEGER NOT NULL, attempts INTEGER NOT NULL, failed_at REAL NOT NULL)"
+        )
+
+    @classmethod
+    def open(cls):
+        """The queue configured by WORK_QUEUE_PATH, or None to keep polling NocoDB."""
+        path = os.getenv("WORK_QUEUE_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            max_depth=int(os.getenv("WORK_QUEUE_MAX_DEPTH", "500")),
+            max_attempts=int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "5")),
+        )
+
+    def depth(self, topic):
+        return self.con.execute("SELECT COUNT(*) FROM jobs WHERE topic = ?", (topic,)).fetchone()[0]
+
+    def dead_letters(self, topic):
+        """The number of jobs in a topic that were given up on after `max_attempts` claims."""
+        return self.con.execute("SELECT COUNT(*) FROM dead_jobs WHERE topic = ?", (topic,)).fetchone()[0]
+
+    def stats(self, topic):
+        return {"topic": topic, "depth": self.depth(topic), "dead_letters": self.dead_letters(topic)}
+
+    def publish(self, topic, record_ids):
+        """Adds record Ids to a topic once there is room; Ids already queued are not added twice."""
+        while self.depth(topic) >= self.max_depth:
+            time.sleep(self.poll_interval)
+        self.con.executemany(
+            "INSERT OR IGNORE INTO jobs (topic, record_id) VALUES (?, ?)",
+            [(topic, record_id) for record_id in record_ids],
+        )
+
+    def claim(self, topic, limit):
+        """Claims up to `limit` jobs, returning (job id, record Id) pairs."""
+        now = time.time()
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            dead = self.con.execute(
+                "SELECT id, record_id, attempts FROM jobs WHERE topic = ? AND claimed_at < ? AND attempts >= ?",
+                (topic, now - self.visibility_timeout, self.max_attempts),
+            ).fetchall()
+            self.con.executemany(
+                "INSERT OR REPLACE INTO dead_jobs (id, topic, record_id, attempts, failed_at) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, topic, record_id, attempts, now) for job_id, record_id, attempts in dead],
+            )
+            self.con.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id, _, _ in dead])
+            rows = self.con.execute(
+                "SELECT id, record_id FROM jobs WHERE topic = ? AND (claimed_at IS NULL OR claimed_at < ?) ORDER BY id LIMIT ?",
+                (topic, now - self.visibility_timeout, limit),
+            ).fetchall()
+            self.con.executemany(
+                "UPDATE jobs SET claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now, job_id) for job_id, _ in rows],
+            )
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        for _, record_id, attempts in dead:
+            print(f"[Work Queue] Giving up on {topic} record {record_id} after {attempts} attempts")
+        return rows
+
+    def wait(self, topic, limit):
+        """Blocks until at least one job can be claimed."""
+        while True:
+            jobs = self.claim(topic, limit)
+            if jobs:
+                return jobs
+            time.sleep(self.poll_interval)
+
+    def ack(self, jobs):
+        self.con.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id, _ in jobs])
@@ -1,66 +1,164 @@
 import os
-import requests
 import dedupe
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import json
-
-CACHE_PATH = "/app/output/fetched_articles.json"
-
-
-def fetch_all_articles(page_size=100, max_records=50000):
+import sys
+from collections import defaultdict
+import nocodb
+from article_mirror import ArticleMirror
+import training
+from cluster_store import ClusterStore, record_fingerprint
+
+CACHE_PATH = "/app/output/fetched_articles.jsonl"
+WATERMARK_PATH = "/app/output/fetched_articles.watermark.json"
+SETTINGS_PATH = "/app/output/dedupe_learned_settings"
+TRAINING_PATH = "/app/output/dedupe_training.json"
+STATE_PATH = "/app/output/grouping_state.db"
+RESULTS_PATH = "/app/output/deduped_results.parquet"
+SUMMARY_PATH = "/app/output/cluster_summary.parquet"
+
+# "incremental" matches only new or edited articles against the stored clusters,
+# "full" re-partitions the whole corpus and rebuilds the stored clusters.
+GROUPING_MODE = os.getenv("GROUPING_MODE", "incremental")
+MATCH_THRESHOLD = 0.5
+SEARCH_CHUNK_SIZE = 500
+
+# "headless" trains from labeled pairs on disk and earlier cluster ids only,
+# "console" falls back to interactive labeling when none are available.
+DEDUPE_TRAINING = os.getenv("DEDUPE_TRAINING", "headless")
+
+# "dedupe" uses the learned blocking predicates, "embedding" pairs each record with
+# its nearest neighbours by title/field embedding before scoring.
+BLOCKING = os.getenv("GROUPING_BLOCKING", "dedupe")
+BLOCKING_NEIGHBORS = 10
+BLOCKING_MIN_SIMILARITY = 0.6
+
+# "offset" fetches pages concurrently, "keyset" walks Id ranges one page at a time
+PAGINATION = os.getenv("NOCO_PAGINATION", "offset")
+FETCH_WORKERS = 8
+UPDATE_BATCH_SIZE = 100
+UPDATE_WORKERS = 4
+# The cache is rewritten with one line per article once superseded lines pass this share of it
+CACHE_COMPACT_RATIO = 0.25
+
+
+def fetch_all_articles(page_size=100, max_records=50000, watermark=None, pagination=PAGINATION):
     db_url = os.getenv("NOCO_DB_URL")
     headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
-    offset = 0
-    fetched = 0
-
-    while True:
-        params = {
-            "fields": "Id,originalTitle,articleUrl,a,b,d",
-            "where": "(a,neq,null)~and(a,neq,'')",
-            "offset": offset,
-            "limit": page_size,
-            "sort": "-articlePublishDateEst",
-        }
-
-        response = requests.get(db_url, headers=headers, params=params)
-        if response.status_code == 422:
-            print(f"Skipping offset {offset}: HTTP 422 - Invalid request")
-            break
-        if response.status_code != 200:
-            print(f"Skipping offset {offset}: HTTP {response.status_code}")
-            offset += page_size
-            continue
-
-        try:
-            json_data = response.json()
-            batch = json_data.get("list", [])
-            if not isinstance(batch, list):
-                print(f"Unexpected response format at offset {offset}: {json_data}")
-                break
-        except Exception as e:
-            print(f"Error decoding JSON at offset {offset}: {e}")
-            break
-
-        if not batch:
-            break  # No more records
-
-        for article in batch:
-            yield article
-
-        offset += page_size
-        fetched += len(batch)
+    fields = "Id,originalTitle,articleUrl,a,b,d,cluster_id,UpdatedAt"
+
+    mirror = ArticleMirror.open()
+    if mirror:
+        where, args = "a IS NOT NULL AND a != ''", ()
+        if watermark:
+            where += " AND (Id > ? OR UpdatedAt >= ?)"
+            args = (watermark["max_id"], watermark["updated_at"])
+        return iter(mirror.query(where, args, order="articlePublishDateEst DESC", limit=max_records, fields=fields))
+
+    where = "(a,neq,null)~and(a,neq,'')"
+    if watermark:
+        # Only articles created or edited since the last fetch. UpdatedAt is compared by day,
+        # so a few already-cached articles come back and are superseded in the cache.
+        where += f"~and((Id,gt,{watermark['max_id']})~or(UpdatedAt,gte,exactDate,{watermark['updated_at'][:10]}))"
+
+    params = {
+        "fields": fields,
+        "where": where,
+        "sort": "-articlePublishDateEst",
+    }
+    if pagination == "keyset":
+        return nocodb.fetch_rows_keyset(db_url, headers, params, page_size, max_records)
+    return nocodb.fetch_rows(db_url, headers, params, page_size, max_records, workers=FETCH_WORKERS)
 
-        if fetched >= max_records:
-            break
+def load_watermark(path=WATERMARK_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-def save_articles_to_disk(articles, path="/app/output/fetched_articles.json"):
+def save_watermark(watermark, path=WATERMARK_PATH):
     with open(path, "w", encoding="utf-8") as f:
-        json.dump(articles, f, ensure_ascii=False, indent=2)
-    print(f"✅ Saved {len(articles)} articles to {path}")
+        json.dump(watermark, f)
+
+def sync_article_cache(path=CACHE_PATH, watermark_path=WATERMARK_PATH):
+    """
+    Writes fetched articles to a JSON Lines cache as they arrive. When a cache and
+    watermark exist, only the delta since the watermark is fetched and appended.
+    The watermark also counts the cache's lines and the lines that re-fetched
+    articles superseded, and the cache is compacted once those pass
+    CACHE_COMPACT_RATIO.
+    """
+    watermark = load_watermark(watermark_path) if os.path.exists(path) else None
+    new_watermark = {"max_id": 0, "updated_at": "", "lines": 0, "superseded": 0, **(watermark or {})}
+    if watermark:
+        print(f"🔄 Fetching articles added after Id {watermark['max_id']} or updated since {watermark['updated_at']}...")
+    else:
+        print("🔄 Fetching articles...")
 
-def load_articles_from_disk(path="/app/output/fetched_articles.json"):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    count = 0
+    with open(path, "a" if watermark else "w", encoding="utf-8") as f:
+        for article in fetch_all_articles(watermark=watermark):
+            f.write(json.dumps(article, ensure_ascii=False) + "\n")
+            count += 1
+            # Articles up to the old max Id were usually cached already; an overcount only compacts a little early
+            if watermark and (article.get("Id") or 0) <= watermark["max_id"]:
+                new_watermark["superseded"] += 1
+            new_watermark["max_id"] = max(new_watermark["max_id"], article.get("Id") or 0)
+            new_watermark["updated_at"] = max(new_watermark["updated_at"], article.get("UpdatedAt") or "")
+
+    new_watermark["lines"] += count
+    print(f"✅ Saved {count} articles to {path}")
+
+    if new_watermark["superseded"] > new_watermark["lines"] * CACHE_COMPACT_RATIO:
+        new_watermark["lines"] = compact_article_cache(path)
+        new_watermark["superseded"] = 0
+
+    # Only advance the watermark once the whole delta is on disk
+    save_watermark(new_watermark, watermark_path)
+
+def compact_article_cache(path=CACHE_PATH):
+    """Rewrites the cache with only the latest line of each article; returns the number of lines kept."""
+    count = 0
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for article in iter_cached_articles(path):
+            f.write(json.dumps(article, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(path + ".tmp", path)
+    print(f"🗜️ Compacted {path} to {count} articles")
+    return count
+
+def _lines_reversed(f, block_size=1 << 20):
+    """Yields the lines of a binary file from last to first, reading it in blocks from the end."""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    tail = b""
+    while position > 0:
+        read = min(block_size, position)
+        position -= read
+        f.seek(position)
+        lines = (f.read(read) + tail).split(b"\n")
+        # The first piece may continue in the previous block
+        tail = lines.pop(0)
+        yield from reversed(lines)
+    yield tail
+
+def iter_cached_articles(path=CACHE_PATH):
+    """
+    Streams articles from the JSON Lines cache, newest lines first. An article
+    appended again by a later delta fetch supersedes its earlier lines, which
+    are skipped; every line is parsed once.
+    """
+    seen = set()
+    with open(path, "rb") as f:
+        for line in _lines_reversed(f):
+            if not line.strip():
+                continue
+            article = json.loads(line)
+            if article["Id"] in seen:
+                continue
+            seen.add(article["Id"])
+            yield article
 
 
 def format_article_for_dedupe(article):
@@ -74,8 +172,61 @@ def format_article_for_dedupe(article):
     }
 
 
-def deduplicate_articles(records):
-    settings_path = '/app/output/dedupe_learned_settings'
+def is_valid(record):
+    """Records need A and at least one other field to be grouped."""
+    if not record.get("A"):
+        return False
+    return any(record.get(f) for f in ["title", "url", "B", "D"])
+
+
+def iter_valid_records(path=CACHE_PATH):
+    """Streams (record_id, formatted record, cached cluster_id) for the valid cached articles."""
+    for article in iter_cached_articles(path):
+        record = format_article_for_dedupe(article)
+        if is_valid(record):
+            yield str(article["Id"]), record, article.get("cluster_id")
+
+
+def train_deduper(records, cluster_ids):
+    fields = [
+        dedupe.variables.String("title"),
+        dedupe.variables.String("url"),
+        dedupe.variables.String("A"),
+        dedupe.variables.String("B"),
+        dedupe.variables.String("D"),
+    ]
+    deduper = dedupe.Dedupe(fields)
+    deduper.prepare_training(records, sample_size=1000)
+
+    # Pairs derived from earlier clusters are unverified, so they train this model but are never saved as labels
+    human_labeled = training.load_labeled_pairs(TRAINING_PATH)
+    labeled = training.merge_labeled_pairs(
+        human_labeled,
+        training.pairs_from_clusters(records, cluster_ids),
+    )
+    if labeled["match"] and labeled["distinct"]:
+        print(f"🏷️ Training from {len(labeled['match'])} match and {len(labeled['distinct'])} distinct labeled pairs...")
+        deduper.mark_pairs(labeled)
+    elif DEDUPE_TRAINING == "console" and sys.stdin.isatty():
+        dedupe.console_label(deduper)
+        human_labeled = training.merge_labeled_pairs(human_labeled, deduper.training_pairs)
+        print("💾 Saving labeled pairs...")
+        training.save_labeled_pairs(TRAINING_PATH, human_labeled)
+    else:
+        raise RuntimeError(
+            f"No labeled pairs in {TRAINING_PATH} or earlier cluster assignments; "
+            "run once with DEDUPE_TRAINING=console on a TTY to label some."
+        )
+
+    deduper.train()
+    print("💾 Saving trained settings...")
+    with open(SETTINGS_PATH, 'wb') as f:
+        deduper.write_settings(f)
+    return deduper
+
+
+def deduplicate_articles(records, cluster_ids=None):
+    settings_path = SETTINGS_PATH
 
     if os.path.exists(settings_path):
         print("📦 Loading trained settings...")
@@ -83,20 +234,22 @@ def deduplicate_articles(records):
             deduper = dedupe.StaticDedupe(f)
     else:
         print("🧠 Training new model...")
-        fields = [
-            dedupe.variables.String("title"),
-            dedupe.variables.String("url"),
-            dedupe.variables.String("A"),
-            dedupe.variables.String("B"),
-            dedupe.variables.String("D"),
-        ]
-        deduper = dedupe.Dedupe(fields)
-        deduper.prepare_training(records, sample_size=1000)
-        dedupe.console_label(deduper)
-        deduper.train()
-        print("💾 Saving trained settings...")
-        with open(settings_path, 'wb') as f:
-            deduper.write_settings(f)
+        deduper = train_deduper(records, cluster_ids or {})
+
+    if BLOCKING == "embedding":
+        # Imported here so the default path does not need torch and faiss installed
+        try:
+            import embedding_blocking
+        except ImportError as e:
+            raise RuntimeError(
+                "GROUPING_BLOCKING=embedding needs requirements-embedding.txt; rebuild with GROUPING_BLOCKING=embedding set"
+            ) from e
+        print("🧮 Clustering embedding-blocked candidates...")
+        return embedding_blocking.partition(
+            deduper, records, neighbors=BLOCKING_NEIGHBORS, min_similarity=BLOCKING_MIN_SIMILARITY
+        )
+
+    training.print_blocking_report(training.blocking_report(deduper, records))
 
     print("🧮 Clustering with auto threshold...")
     clustered_dupes = deduper.partition(records)
@@ -104,94 +257,316 @@ def deduplicate_articles(records):
     return clustered_dupes
 
 
-def save_results(clustered_dupes, records, output_path="deduped_results.csv"):
-    rows = []
-    for cluster_id, (record_ids, confidence) in enumerate(clustered_dupes):
+def stable_cluster_ids(clustered_dupes, previous_cluster_ids):
+    """
+    Numbers the clusters of a full run so each keeps the cluster_id most of its
+    members already had, which keeps the write-back to the articles whose
+    cluster really changed. When an earlier cluster was split, its id goes to
+    the part holding most of its members; clusters without one get ids above
+    every id in use. Returns (cluster_id, record_ids, scores) tuples.
+    """
+    candidates = []
+    for index, (record_ids, _) in enumerate(clustered_dupes):
+        votes = defaultdict(int)
         for record_id in record_ids:
-            record = records[record_id].copy()
-            record["cluster_id"] = cluster_id
-            record["confidence"] = confidence
-            rows.append(record)
-
-    df = pd.DataFrame(rows)
-    df.to_csv(output_path, index=False)
+            previous = previous_cluster_ids.get(str(record_id))
+            if previous is not None and str(previous).lstrip("-").isdigit():
+                votes[int(previous)] += 1
+        candidates.extend((count, index, cluster_id) for cluster_id, count in votes.items())
+
+    ids = {}
+    claimed = set()
+    for count, index, cluster_id in sorted(candidates, key=lambda c: (-c[0], c[1])):
+        if index not in ids and cluster_id not in claimed:
+            ids[index] = cluster_id
+            claimed.add(cluster_id)
+
+    in_use = [int(c) for c in previous_cluster_ids.values() if c is not None and str(c).lstrip("-").isdigit()]
+    next_cluster_id = max(in_use, default=-1) + 1
+    clusters = []
+    for index, (record_ids, scores) in enumerate(clustered_dupes):
+        if index not in ids:
+            ids[index] = next_cluster_id
+            next_cluster_id += 1
+        clusters.append((ids[index], record_ids, scores))
+    print(f"🔢 {len(claimed)} clusters kept their cluster_id, {len(clusters) - len(claimed)} got a new one")
+    return clusters
+
+
+def seed_cluster_store(store, clusters, records):
+    store.reset()
+    for cluster_id, record_ids, _ in clusters:
+        canonical_id = str(record_ids[0])
+        store.add_canonical(cluster_id, canonical_id, records[canonical_id])
+        for record_id in record_ids:
+            store.assign(str(record_id), records[str(record_id)], cluster_id)
+    store.commit()
+
+
+def match_incrementally(store, records):
+    """
+    Assigns new or edited records to the stored clusters by matching them
+    against one canonical record per cluster. Records without a match above
+    MATCH_THRESHOLD start a new cluster and become its canonical record.
+    Returns {record_id: cluster_id} for the given records only.
+    """
+    print("📦 Loading trained settings for matching...")
+    with open(SETTINGS_PATH, 'rb') as f:
+        gazetteer = dedupe.StaticGazetteer(f)
+
+    canonical = store.canonical_records()
+    canonical_clusters = store.canonical_clusters()
+    assignments = {}
+
+    # Edited canonical records keep their cluster but are indexed with their new values
+    edited = {rid: record for rid, record in records.items() if rid in canonical_clusters}
+    gazetteer.index({**canonical, **edited})
+    for rid, record in edited.items():
+        cluster_id = canonical_clusters[rid]
+        store.add_canonical(cluster_id, rid, record)
+        store.assign(rid, record, cluster_id)
+        assignments[rid] = cluster_id
+
+    print(f"🔗 Indexed {len(canonical)} canonical records, matching {len(records) - len(edited)} new or edited records...")
+    next_cluster_id = store.next_cluster_id()
+    pending = [(rid, record) for rid, record in records.items() if rid not in edited]
+    for start in range(0, len(pending), SEARCH_CHUNK_SIZE):
+        chunk = dict(pending[start:start + SEARCH_CHUNK_SIZE])
+        new_canonical = {}
+        for rid, matches in gazetteer.search(chunk, threshold=MATCH_THRESHOLD, n_matches=1, generator=True):
+            if matches:
+                cluster_id = canonical_clusters[matches[0][0]]
+            else:
+                cluster_id = next_cluster_id
+                next_cluster_id += 1
+                canonical_clusters[rid] = cluster_id
+                new_canonical[rid] = chunk[rid]
+                store.add_canonical(cluster_id, rid, chunk[rid])
+            store.assign(rid, chunk[rid], cluster_id)
+            assignments[rid] = cluster_id
+
+        # Later chunks can match the clusters started by this one
+        if new_canonical:
+            gazetteer.index(new_canonical)
+        store.commit()
+
+    new_clusters = len(canonical_clusters) - len(canonical)
+    print(f"✅ Matched {len(assignments)} records, {new_clusters} new clusters")
+    return assignments
+
+
+RESULT_SCHEMA = pa.schema([
+    ("Id", pa.string()),
+    ("cluster_id", pa.int64()),
+    ("confidence", pa.float64()),
+    ("title", pa.string()),
+    ("url", pa.string()),
+    ("A", pa.string()),
+    ("B", pa.string()),
+    ("D", pa.string()),
+])
+
+SUMMARY_SCHEMA = pa.schema([
+    ("cluster_id", pa.int64()),
+    ("size", pa.int64()),
+    ("confidence_min", pa.float64()),
+    ("confidence_mean", pa.float64()),
+    ("confidence_max", pa.float64()),
+    ("representative_id", pa.string()),
+    ("representative_title", pa.string()),
+])
+
+
+def save_results(clusters, records, output_path=RESULTS_PATH, summary_path=SUMMARY_PATH, batch_size=10000):
+    """
+    Streams one row per record to a Parquet file in batches, and writes a
+    per-cluster summary table with the cluster's size, confidence distribution
+    and the title of its most confident record. `clusters` yields
+    (cluster_id, record_ids, scores); a cluster without scores is represented
+    by its first record.
+    """
+    rows = {name: [] for name in RESULT_SCHEMA.names}
+    summary = {name: [] for name in SUMMARY_SCHEMA.names}
+
+    with pq.ParquetWriter(output_path, RESULT_SCHEMA) as writer:
+        for cluster_id, record_ids, scores in clusters:
+            scores = [None if score is None else float(score) for score in scores]
+            for record_id, score in zip(record_ids, scores):
+                record = records[record_id]
+                rows["Id"].append(str(record_id))
+                rows["cluster_id"].append(cluster_id)
+                rows["confidence"].append(score)
+                for field in ("title", "url", "A", "B", "D"):
+                    rows[field].append(record.get(field))
+
+            known = [score for score in scores if score is not None]
+            representative = record_ids[scores.index(max(known))] if known else record_ids[0]
+            summary["cluster_id"].append(cluster_id)
+            summary["size"].append(len(record_ids))
+            summary["confidence_min"].append(min(known) if known else None)
+            summary["confidence_mean"].append(sum(known) / len(known) if known else None)
+            summary["confidence_max"].append(max(known) if known else None)
+            summary["representative_id"].append(str(representative))
+            summary["representative_title"].append(records[representative].get("title"))
+
+            if len(rows["Id"]) >= batch_size:
+                writer.write_table(pa.Table.from_pydict(rows, schema=RESULT_SCHEMA))
+                rows = {name: [] for name in RESULT_SCHEMA.names}
+
+        if rows["Id"]:
+            writer.write_table(pa.Table.from_pydict(rows, schema=RESULT_SCHEMA))
+
+    pq.write_table(pa.Table.from_pydict(summary, schema=SUMMARY_SCHEMA), summary_path)
+    grouped = sum(1 for size in summary["size"] if size > 1)
     print(f"Saved clustered results to {output_path}")
+    print(f"Saved summary of {len(summary['cluster_id'])} clusters ({grouped} with more than one article) to {summary_path}")
+
+def save_incremental_results(store, rows, output_path=RESULTS_PATH, summary_path=SUMMARY_PATH, batch_size=10000):
+    """
+    Streams `rows` of (record_id, cluster_id, record) to the results Parquet file
+    in batches, so incremental runs never hold the corpus in memory, and writes
+    the cluster summary from the member counts. Incremental matching has no
+    confidence scores; each cluster is represented by its canonical record.
+    """
+    batch = {name: [] for name in RESULT_SCHEMA.names}
+    sizes = defaultdict(int)
+
+    with pq.ParquetWriter(output_path, RESULT_SCHEMA) as writer:
+        for record_id, cluster_id, record in rows:
+            batch["Id"].append(record_id)
+            batch["cluster_id"].append(cluster_id)
+            batch["confidence"].append(None)
+            for field in ("title", "url", "A", "B", "D"):
+                batch[field].append(record.get(field))
+            sizes[cluster_id] += 1
+
+            if len(batch["Id"]) >= batch_size:
+                writer.write_table(pa.Table.from_pydict(batch, schema=RESULT_SCHEMA))
+                batch = {name: [] for name in RESULT_SCHEMA.names}
+
+        if batch["Id"]:
+            writer.write_table(pa.Table.from_pydict(batch, schema=RESULT_SCHEMA))
+
+    summary = {name: [] for name in SUMMARY_SCHEMA.names}
+    for cluster_id, size in sorted(sizes.items()):
+        canonical_id, canonical = store.canonical(cluster_id)
+        summary["cluster_id"].append(cluster_id)
+        summary["size"].append(size)
+        summary["confidence_min"].append(None)
+        summary["confidence_mean"].append(None)
+        summary["confidence_max"].append(None)
+        summary["representative_id"].append(canonical_id)
+        summary["representative_title"].append(canonical.get("title") if canonical else None)
+
+    pq.write_table(pa.Table.from_pydict(summary, schema=SUMMARY_SCHEMA), summary_path)
+    grouped = sum(1 for size in sizes.values() if size > 1)
+    print(f"Saved clustered results to {output_path}")
+    print(f"Saved summary of {len(sizes)} clusters ({grouped} with more than one article) to {summary_path}")
 
-def update_article(article_id, cluster_id):
+def update_cluster_ids(assignments, current_cluster_ids):
+    """
+    Writes cluster_id back to NocoDB in batched list PATCHes, skipping articles
+    whose stored cluster_id already matches.
+    """
     db_url = os.getenv("NOCO_DB_URL")
     headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
 
-    data = {
-        "id": article_id,
-        "cluster_id": cluster_id,
+    rows = [
+        {"Id": int(record_id), "cluster_id": cluster_id}
+        for record_id, cluster_id in assignments.items()
+        if str(current_cluster_ids.get(record_id)) != str(cluster_id)
+    ]
+    summary = nocodb.patch_rows(db_url, headers, rows, batch_size=UPDATE_BATCH_SIZE, workers=UPDATE_WORKERS)
+    summary["unchanged"] = len(assignments) - len(rows)
+    return summary
+
+
+def run_incremental(store):
+    """
+    Matches new or edited records against the stored clusters while streaming
+    the cache, so only those records and the stored canonical records are held
+    in memory. Returns the write-back rows, {record_id: cluster_id}, for the
+    articles whose cached cluster_id differs from the stored one, and the
+    number of articles already up to date.
+    """
+    print("📁 Streaming articles from disk...")
+    changed = {
+        rid: record for rid, record, _ in iter_valid_records(CACHE_PATH)
+        if store.fingerprint(rid) != record_fingerprint(record)
     }
+    print(f"🧠 Running incremental deduplication on {len(changed)} new or edited records...")
+    match_incrementally(store, changed)
+
+    # Diff every stored assignment so write-backs that failed on an earlier run are retried
+    write_back = {}
+    unchanged = 0
+
+    def rows():
+        nonlocal unchanged
+        for rid, record, cached_cluster_id in iter_valid_records(CACHE_PATH):
+            cluster_id = store.cluster_id(rid)
+            if cluster_id is None:
+                continue
+            if str(cached_cluster_id) != str(cluster_id):
+                write_back[rid] = cluster_id
+            else:
+                unchanged += 1
+            yield rid, cluster_id, record
 
-    response = requests.patch(db_url, headers=headers, json=data)
-    if response.status_code not in (200, 204):
-        print(f"⚠️ Failed to update article {article_id}: {response.status_code} - {response.text}")
+    print("💾 Saving results...")
+    save_incremental_results(store, rows())
+    return write_back, unchanged
 
-def update_article(article_id, cluster_id):
-    db_url = os.getenv("NOCO_DB_URL")
-    headers = {
-        "xc-token": os.getenv("NOCO_XC_TOKEN"),
-        "Content-Type": "application/json",
-    }
 
-    data = {
-        "id": article_id,
-        "cluster_id": cluster_id,
-    }
+def main():
+    sync_article_cache(CACHE_PATH, WATERMARK_PATH)
 
-    response = requests.patch(db_url, headers=headers, json=data)
-    if response.status_code not in (200, 204):
-        print(f"⚠️ Failed to update article {article_id}: {response.status_code} - {response.text}")
+    store = ClusterStore(STATE_PATH)
+    if GROUPING_MODE == "incremental" and os.path.exists(SETTINGS_PATH) and not store.is_empty():
+        assignments, unchanged = run_incremental(store)
+        current_cluster_ids = {}
     else:
-        print(f"✅ Updated article {article_id} (cluster {cluster_id})")
-
-
-
-def main():
-    if  os.path.exists(CACHE_PATH):
         print("📁 Loading articles from disk...")
-        raw_articles = load_articles_from_disk(CACHE_PATH)
-    else:
-        print("🔄 Fetching articles...")
-        raw_articles = list(fetch_all_articles())
-        save_articles_to_disk(raw_articles, CACHE_PATH)
-
-    print(f"✅ Got {len(raw_articles)} articles")
-
-    # Format first, then filter
-    formatted_records = {
-        str(article["Id"]): format_article_for_dedupe(article)
-        for article in raw_articles
-    }
-
-    # Filter records: must have A and at least one other field
-    def is_valid(record):
-        if not record.get("A"):
-            return False
-        return any(record.get(f) for f in ["title", "url", "B", "D"])
-
-    records = {
-        rid: record for rid, record in formatted_records.items()
-        if is_valid(record)
-    }
+        # Format first, then filter
+        formatted_records = {}
+        current_cluster_ids = {}
+        for article in iter_cached_articles(CACHE_PATH):
+            formatted_records[str(article["Id"])] = format_article_for_dedupe(article)
+            current_cluster_ids[str(article["Id"])] = article.get("cluster_id")
+
+        print(f"✅ Got {len(formatted_records)} articles")
+
+        records = {
+            rid: record for rid, record in formatted_records.items()
+            if is_valid(record)
+        }
 
-    print(f"✅ Filtered to {len(records)} valid records (A + other fields present).")
+        print(f"✅ Filtered to {len(records)} valid records (A + other fields present).")
 
+        print("🧠 Running deduplication...")
+        clustered_dupes = deduplicate_articles(records, current_cluster_ids)
+        clusters = stable_cluster_ids(clustered_dupes, current_cluster_ids)
 
-    print("🧠 Running deduplication...")
-    clustered_dupes = deduplicate_articles(records)
+        print("💾 Saving results...")
+        save_results(clusters, records)
+        seed_cluster_store(store, clusters, records)
 
-    print("💾 Saving results...")
-    save_results(clustered_dupes, records, output_path="/app/output/deduped_results.csv")
+        assignments = {
+            str(record_id): cluster_id
+            for cluster_id, record_ids, _ in clusters
+            for record_id in record_ids
+        }
+        unchanged = None
+    store.close()
 
     print("🔄 Updating articles in NOCO...")
-    for cluster_id, (record_ids, confidence) in enumerate(clustered_dupes):
-        for record_id in record_ids:
-            update_article(str(record_id), cluster_id)
-
-    print("✅ Finished updating articles in NOCO.")
+    summary = update_cluster_ids(assignments, current_cluster_ids)
+    if unchanged is not None:
+        summary["unchanged"] = unchanged
+
+    print(
+        f"✅ Finished updating articles in NOCO: {summary['updated']} updated in {summary['batches']} batches, "
+        f"{summary['unchanged']} unchanged, {summary['failed']} failed."
+    )
 if __name__ == '__main__':
     main()
@@ -0,0 +1,206 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import requests
+
+# Copied into the service directories from shared/ by shared/sync.py; edit shared/ and re-run it.
+
+# Article fields copied into their own indexed columns, keyed by NocoDB field name
+INDEXED_COLUMNS = {
+    "articleUrl": "articleUrl",
+    "originalTitle": "originalTitle",
+    "isEnglish": "isEnglish",
+    "AIScore4": "AIScore4",
+    "BU ID": "bu_id",
+    "a": "a",
+    "country": "country",
+    "articlePublishDateEst": "articlePublishDateEst",
+    "UpdatedAt": "UpdatedAt",
+}
+
+INDEXES = [
+    "articleUrl",
+    "originalTitle",
+    "isEnglish, AIScore4, articlePublishDateEst",
+    "bu_id",
+    "a",
+    "country, articlePublishDateEst",
+    "UpdatedAt",
+]
+
+
+class ArticleMirror:
+    """
+    Local SQLite copy of the NocoDB articles table. The mirror service keeps it
+    in sync from an UpdatedAt watermark; the other services read from it and
+    write through it, which updates NocoDB first and then the local row.
+    """
+
+    def __init__(self, path):
+        self.con = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self.con.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(INDEXED_COLUMNS.values())
+        self.con.execute(f"CREATE TABLE IF NOT EXISTS articles (Id INTEGER PRIMARY KEY, data TEXT NOT NULL, {columns})")
+        for i, index in enumerate(INDEXES):
+            self.con.execute(f"CREATE INDEX IF NOT EXISTS articles_{i} ON articles ({index})")
+        self.con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.con.commit()
+
+    @classmethod
+    def open(cls):
+        """
+        The mirror configured by ARTICLE_MIRROR_PATH, or None to read NocoDB directly.
+        The mirror service creates the file before its first sync finishes, so the
+        mirror is only used once a sync has completed and recorded `synced_at`.
+        """
+        path = os.getenv("ARTICLE_MIRROR_PATH")
+        if not path or not os.path.exists(path):
+            return None
+        mirror = cls(path)
+        if mirror.get_meta("synced_at") is None:
+            mirror.con.close()
+            return None
+        return mirror
+
+    def get_meta(self, key, default=None):
+        row = self.con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.con.execute("REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def upsert(self, rows, commit=True):
+        """Merges rows into the mirror; fields missing from a row keep their stored value."""
+        for row in rows:
+            existing = self.con.execute("SELECT data FROM articles WHERE Id = ?", (row["Id"],)).fetchone()
+            data = {**json.loads(existing[0]), **row} if existing else dict(row)
+            values = [data.get(field) for field in INDEXED_COLUMNS]
+            values = [int(v) if isinstance(v, bool) else v for v in values]
+            placeholders = ", ".join("?" for _ in range(len(INDEXED_COLUMNS) + 2))
+            self.con.execute(
+                f"REPLACE INTO articles (Id, data, {', '.join(INDEXED_COLUMNS.values())}) VALUES ({placeholders})",
+                [data["Id"], json.dumps(data, ensure_ascii=False), *values],
+            )
+        if commit:
+            self.con.commit()
+
+    def query(self, where="1 = 1", params=(), order=None, limit=None, offset=0, fields=None):
+        """
+        Articles matching an SQL condition on the indexed columns, as dicts with the
+        same fields NocoDB would return.
+        """
+        sql = f"SELECT data FROM articles WHERE {where}"
+        if order:
+            sql += f" ORDER BY {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        rows = (json.loads(row[0]) for row in self.con.execute(sql, params))
+        if fields:
+            wanted = fields.split(",") if isinstance(fields, str) else fields
+            return [{field: row.get(field) for field in wanted} for row in rows]
+        return list(rows)
+
+    def count(self, where="1 = 1", params=()):
+        return self.con.execute(f"SELECT COUNT(*) FROM articles WHERE {where}", params).fetchone()[0]
+
+    def _pages(self, db_url, headers, where, page_size, fields=None):
+        """Pages of rows matching `where`, walked by Id so they stay stable while NocoDB changes."""
+        last_id = 0
+        while True:
+            id_filter = f"(Id,gt,{last_id})"
+            params = {
+                "where": f"{where}~and{id_filter}" if where else id_filter,
+                "sort": "Id",
+                "limit": page_size,
+            }
+            if fields:
+                params["fields"] = fields
+            response = requests.get(db_url, headers=headers, params=params, timeout=60)
+            response.raise_for_status()
+            rows = response.json().get("list", [])
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1]["Id"]
+
+    def _changed_rows(self, db_url, headers, where, page_size, chunk_size=100):
+        """
+        Full rows for the articles matching `where` whose UpdatedAt differs from the
+        mirrored copy. Only Id and UpdatedAt are listed; full rows are fetched for
+        the changed Ids alone.
+        """
+        for stubs in self._pages(db_url, headers, where, page_size, fields="Id,UpdatedAt"):
+            changed = []
+            for stub in stubs:
+                stored = self.con.execute("SELECT UpdatedAt FROM articles WHERE Id = ?", (stub["Id"],)).fetchone()
+                if stored is None or stored[0] != stub.get("UpdatedAt"):
+                    changed.append(stub["Id"])
+            for start in range(0, len(changed), chunk_size):
+                ids = changed[start:start + chunk_size]
+                params = {"where": "~or".join(f"(Id,eq,{i})" for i in ids), "limit": len(ids)}
+                response = requests.get(db_url, headers=headers, params=params, timeout=60)
+                response.raise_for_status()
+                yield response.json().get("list", [])
+
+    def _total(self, db_url, headers):
+        params = {"fields": "Id", "limit": 1}
+        response = requests.get(db_url, headers=headers, params=params, timeout=60)
+        response.raise_for_status()
+        return response.json().get("pageInfo", {}).get("totalRows")
+
+    def sync(self, db_url, headers, page_size=1000, full=False, job=None):
+        """
+        Copies articles updated since the stored watermark (or every article when
+        `full`, which also drops rows deleted in NocoDB). NocoDB filters UpdatedAt
+        by day, so an incremental sync lists the day's Ids and UpdatedAt values
+        and downloads only the rows that differ from the mirror. Progress is
+        reported to `job` after every page, which is also where a cancelled
+        sync stops. Returns the number of rows copied.
+        """
+        watermark = None if full else self.get_meta("updated_at")
+        started = datetime.utcnow().isoformat()
+        newest = watermark or ""
+        seen = set()
+        count = 0
+
+        if watermark:
+            pages = self._changed_rows(db_url, headers, f"(UpdatedAt,gte,exactDate,{watermark[:10]})", page_size)
+        else:
+            pages = self._pages(db_url, headers, None, page_size)
+            if job:
+                job.set_total(self._total(db_url, headers))
+        for rows in pages:
+            self.upsert(rows, commit=False)
+            for row in rows:
+                seen.add(row["Id"])
+                newest = max(newest, row.get("UpdatedAt") or "")
+            count += len(rows)
+            self.con.commit()
+            if job:
+                job.advance(len(rows))
+
+        if full:
+            stored = {row[0] for row in self.con.execute("SELECT Id FROM articles")}
+            self.con.executemany("DELETE FROM articles WHERE Id = ?", [(i,) for i in stored - seen])
+        self.set_meta("updated_at", newest)
+        self.set_meta("synced_at", started)
+        self.con.commit()
+        return count
+
+    def write_through(self, db_url, headers, rows, method="PATCH"):
+        """
+        Sends a PATCH or POST to NocoDB and applies the same change locally once it
+        succeeds. Returns the NocoDB response.
+        """
+        response = requests.request(method, db_url, headers=headers, json=rows)
+        if response.status_code == 200:
+            created = response.json() if method == "POST" else None
+            batch = rows if isinstance(rows, list) else [rows]
+            if method == "POST":
+                ids = created if isinstance(created, list) else [created]
+                batch = [{**row, "Id": ref["Id"]} for row, ref in zip(batch, ids)]
+            self.upsert([row for row in batch if row.get("Id") is not None])
+        return response
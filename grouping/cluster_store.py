@@ -0,0 +1,80 @@
+import hashlib
+import json
+import sqlite3
+
+
+def record_fingerprint(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ClusterStore:
+    """
+    Persisted clustering state for incremental grouping runs.
+
+    `articles` keeps the cluster of every article together with a fingerprint of
+    the record it was clustered from, so later runs only need to match new or
+    edited articles. `canonical` holds one representative record per cluster;
+    these are the records new articles are matched against.
+    """
+
+    def __init__(self, path):
+        self.con = sqlite3.connect(path)
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS articles (id TEXT PRIMARY KEY, fingerprint TEXT, cluster_id INTEGER)"
+        )
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS canonical (cluster_id INTEGER PRIMARY KEY, id TEXT, record TEXT)"
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS articles_cluster ON articles (cluster_id)")
+        self.con.commit()
+
+    def is_empty(self):
+        return self.con.execute("SELECT COUNT(*) FROM canonical").fetchone()[0] == 0
+
+    def fingerprint(self, record_id):
+        row = self.con.execute("SELECT fingerprint FROM articles WHERE id = ?", (record_id,)).fetchone()
+        return row[0] if row else None
+
+    def cluster_id(self, record_id):
+        row = self.con.execute("SELECT cluster_id FROM articles WHERE id = ?", (record_id,)).fetchone()
+        return row[0] if row else None
+
+    def canonical(self, cluster_id):
+        """The (record id, record) a cluster is matched by, or (None, None) when it has none."""
+        row = self.con.execute("SELECT id, record FROM canonical WHERE cluster_id = ?", (cluster_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, None)
+
+    def canonical_records(self):
+        return {
+            record_id: json.loads(record)
+            for record_id, record in self.con.execute("SELECT id, record FROM canonical")
+        }
+
+    def canonical_clusters(self):
+        return dict(self.con.execute("SELECT id, cluster_id FROM canonical"))
+
+    def next_cluster_id(self):
+        return self.con.execute("SELECT COALESCE(MAX(cluster_id), -1) + 1 FROM canonical").fetchone()[0]
+
+    def assign(self, record_id, record, cluster_id):
+        self.con.execute(
+            "REPLACE INTO articles VALUES (?, ?, ?)",
+            (record_id, record_fingerprint(record), cluster_id),
+        )
+
+    def add_canonical(self, cluster_id, record_id, record):
+        self.con.execute(
+            "REPLACE INTO canonical VALUES (?, ?, ?)",
+            (cluster_id, record_id, json.dumps(record, ensure_ascii=False)),
+        )
+
+    def reset(self):
+        self.con.execute("DELETE FROM articles")
+        self.con.execute("DELETE FROM canonical")
+
+    def commit(self):
+        self.con.commit()
+
+    def close(self):
+        self.con.commit()
+        self.con.close()
@@ -0,0 +1,65 @@
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+# Same model the rag matcher uses for articles
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def record_text(record):
+    return " | ".join(str(record.get(field) or "") for field in ("title", "A", "B", "D"))
+
+
+def embed_records(records, batch_size=256):
+    model = SentenceTransformer(MODEL_NAME)
+    texts = [record_text(record) for record in records.values()]
+    embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=True)
+    return np.asarray(embeddings, dtype="float32")
+
+
+def candidate_pairs(records, neighbors=10, min_similarity=0.6):
+    """
+    Candidate pairs for the dedupe scorer from an approximate nearest-neighbour
+    search over record embeddings. Each record is paired with at most `neighbors`
+    others, so the number of comparisons grows linearly with the corpus.
+    Yields ((id, record), (id, record)) like `Dedupe.pairs`.
+    """
+    ids = list(records.keys())
+    if len(ids) < 2:
+        return
+
+    embeddings = embed_records(records)
+    # Inner product on normalized embeddings is cosine similarity
+    index = faiss.IndexHNSWFlat(embeddings.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+    index.add(embeddings)
+    similarities, neighbours = index.search(embeddings, min(neighbors + 1, len(ids)))
+
+    seen = set()
+    for i, (row_similarities, row_neighbours) in enumerate(zip(similarities, neighbours)):
+        for similarity, j in zip(row_similarities, row_neighbours):
+            if j < 0 or j == i or similarity < min_similarity:
+                continue
+            pair = (min(i, j), max(i, j))
+            if pair in seen:
+                continue
+            seen.add(pair)
+            a, b = ids[pair[0]], ids[pair[1]]
+            yield (a, records[a]), (b, records[b])
+
+
+def partition(deduper, records, threshold=0.5, neighbors=10, min_similarity=0.6):
+    """
+    `Dedupe.partition` with embedding blocking in place of the learned predicates.
+    Records that end up in no cluster are returned as singletons.
+    """
+    pairs = list(candidate_pairs(records, neighbors, min_similarity))
+    print(f"🧱 Embedding blocking produced {len(pairs)} candidate pairs for {len(records)} records")
+
+    clusters = []
+    if pairs:
+        scores = deduper.score(pairs)
+        clusters = list(deduper.cluster(scores, threshold))
+
+    clustered = {record_id for record_ids, _ in clusters for record_id in record_ids}
+    singletons = [((record_id,), (1.0,)) for record_id in records if record_id not in clustered]
+    return clusters + singletons
@@ -0,0 +1,117 @@
+import itertools
+import json
+import os
+import random
+from collections import Counter, defaultdict
+
+
+def load_labeled_pairs(path):
+    """
+    Reads labeled pairs in the format written by `Dedupe.write_training`:
+    {"match": [[record, record], ...], "distinct": [[record, record], ...]}
+    """
+    if not os.path.exists(path):
+        return {"match": [], "distinct": []}
+    with open(path, "r", encoding="utf-8") as f:
+        labeled = json.load(f)
+    return {
+        "match": [tuple(pair) for pair in labeled.get("match", [])],
+        "distinct": [tuple(pair) for pair in labeled.get("distinct", [])],
+    }
+
+
+def save_labeled_pairs(path, labeled):
+    """Writes labeled pairs in the same format `load_labeled_pairs` reads."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {label: [list(pair) for pair in labeled[label]] for label in ("match", "distinct")},
+            f,
+            ensure_ascii=False,
+        )
+
+
+def pairs_from_clusters(records, cluster_ids, max_pairs=500, per_cluster=5, seed=0):
+    """
+    Derives labeled pairs from earlier cluster_id assignments. Articles sharing a
+    cluster become matches; representatives of different clusters with the same
+    recipient country become distinct pairs, which are the hard cases for blocking.
+    """
+    rng = random.Random(seed)
+    clusters = defaultdict(list)
+    for record_id, cluster_id in cluster_ids.items():
+        if cluster_id is not None and record_id in records:
+            clusters[str(cluster_id)].append(record_id)
+
+    match = []
+    for members in clusters.values():
+        for a, b in itertools.combinations(members[:per_cluster], 2):
+            match.append((records[a], records[b]))
+
+    by_country = defaultdict(list)
+    for members in clusters.values():
+        by_country[records[members[0]].get("A")].append(members[0])
+    distinct = []
+    for representatives in by_country.values():
+        rng.shuffle(representatives)
+        for a, b in zip(representatives[::2], representatives[1::2]):
+            distinct.append((records[a], records[b]))
+
+    rng.shuffle(match)
+    rng.shuffle(distinct)
+    return {"match": match[:max_pairs], "distinct": distinct[:max_pairs]}
+
+
+def merge_labeled_pairs(*labeled_sets):
+    merged = {"match": [], "distinct": []}
+    seen = set()
+    for labeled in labeled_sets:
+        for label in ("match", "distinct"):
+            for a, b in labeled[label]:
+                key = frozenset((str(a.get("Id")), str(b.get("Id"))))
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged[label].append((a, b))
+    return merged
+
+
+def blocking_report(deduper, records):
+    """
+    Counts, for each learned blocking predicate, how many records it places in
+    at least one block, and the number of pairwise comparisons the blocks imply.
+    Comparisons are an upper bound: pairs sharing several blocks are only scored
+    once by dedupe.
+    """
+    fingerprinter = deduper.fingerprinter
+    fingerprinter.index_all(records)
+
+    block_sizes = Counter()
+    covered = defaultdict(set)
+    for block_key, record_id in fingerprinter(records.items()):
+        block_sizes[block_key] += 1
+        covered[block_key.rsplit(":", 1)[-1]].add(record_id)
+
+    fingerprinter.reset_indices()
+
+    comparisons = sum(n * (n - 1) // 2 for n in block_sizes.values())
+    predicates = []
+    for i, predicate in enumerate(fingerprinter.predicates):
+        predicates.append({
+            "predicate": str(predicate),
+            "coverage": len(covered.get(str(i), ())) / max(len(records), 1),
+        })
+
+    return {
+        "records": len(records),
+        "blocks": len(block_sizes),
+        "comparisons": comparisons,
+        "predicates": predicates,
+    }
+
+
+def print_blocking_report(report):
+    full = report["records"] * (report["records"] - 1) // 2
+    print(f"🧱 {report['blocks']} blocks, {report['comparisons']} comparisons "
+          f"({report['comparisons'] / max(full, 1):.4%} of all {full} pairs)")
+    for predicate in report["predicates"]:
+        print(f"   {predicate['coverage']:.1%} coverage — {predicate['predicate']}")
@@ -0,0 +1,62 @@
+from flask import Flask, jsonify
+from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import datetime
+from dotenv import load_dotenv
+
+import os
+import threading
+from article_mirror import ArticleMirror
+from job_runner import JobRunner
+
+app = Flask(__name__)
+scheduler = BackgroundScheduler()
+
+MIRROR_PATH = os.getenv("ARTICLE_MIRROR_PATH", "/mirror/articles.db")
+SYNC_PAGE_SIZE = 1000
+SYNC_INTERVAL_MINUTES = int(os.getenv("MIRROR_SYNC_INTERVAL_MINUTES", "1"))
+
+mirror = None
+# Incremental and full syncs share the mirror's connection, so only one runs at a time
+sync_lock = threading.Lock()
+
+@app.route("/health")
+def health_check():
+    return "healthy"
+
+@app.route("/status")
+def status():
+    return jsonify({
+        "articles": mirror.count(),
+        "updated_at": mirror.get_meta("updated_at"),
+        "synced_at": mirror.get_meta("synced_at"),
+    })
+
+def sync(full=False, job=None):
+    try:
+        started = datetime.now()
+        url = os.getenv("NOCO_DB_URL")
+        headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+        with sync_lock:
+            count = mirror.sync(url, headers, page_size=SYNC_PAGE_SIZE, full=full, job=job)
+        kind = "Full sync" if full else "Sync"
+        print(f"[MOF Mirror] {kind} copied {count} articles in {datetime.now() - started}")
+    except Exception as e:
+        print(f"[MOF Mirror] Error: {e}")
+        # Re-raised so the job runner records the run as failed
+        raise
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    os.makedirs(os.path.dirname(MIRROR_PATH) or ".", exist_ok=True)
+    mirror = ArticleMirror(MIRROR_PATH)
+    print(f"[MOF Mirror] Mirroring articles to {MIRROR_PATH}")
+    runner = JobRunner(app, scheduler)
+    runner.register("sync", sync)
+    runner.register("full-sync", sync, full=True)
+    # Incremental syncs follow the UpdatedAt watermark; the nightly full sync also drops deleted articles
+    runner.schedule("sync", "interval", minutes=SYNC_INTERVAL_MINUTES)
+    runner.schedule("full-sync", "cron", hour="3", minute="0")
+    scheduler.start()
+    runner.trigger("sync")
+    app.run(port=5006)
@@ -1,14 +1,53 @@
+import multiprocessing
 import pandas as pd
-from sentence_transformers import SentenceTransformer, CrossEncoder
+import torch
 import chromadb
+import hashlib
 import json
 import os
 import requests
+import inference
+import nocodb
+from article_mirror import ArticleMirror
+from embedding_cache import EmbeddingCache
+from project_index import ChromaRetriever, ProjectIndex
 
 CSV_PATH = "/app/database.csv"
-CHROMA_CACHE_PATH = "/app/output/chroma_cache.json"
 CACHE_PATH = "/app/output/fetched_articles.json"
 CHROMA_PATH = "/data"
+EMBEDDING_CACHE_PATH = "/app/output/article_embeddings"
+FAISS_INDEX_PATH = "/app/output/faiss_projects"
+
+# "offset" fetches pages concurrently, "keyset" walks Id ranges one page at a time
+PAGINATION = os.getenv("NOCO_PAGINATION", "offset")
+FETCH_WORKERS = 8
+
+# "torch", "onnx" or "onnx-int8", see inference.py
+INFERENCE_BACKEND = os.getenv("RAG_INFERENCE_BACKEND", "torch")
+
+MATCH_BATCH_SIZE = 64
+ENCODE_BATCH_SIZE = 32
+RERANK_BATCH_SIZE = 128
+INGEST_BATCH_SIZE = 256
+# MiniLM reads at most 256 tokens; the weighted article text is built to fit
+ARTICLE_TOKEN_BUDGET = 256
+N_RESULTS = 75  # Increased from 50 to 75 to get even more candidates
+
+# "index" searches a per-country NumPy index built from the collection,
+# "faiss" a FAISS index saved under FAISS_INDEX_PATH and memory-mapped at startup,
+# "chroma" queries Chroma with a BU ID filter per article.
+RETRIEVAL_BACKEND = os.getenv("RAG_RETRIEVAL_BACKEND", "index")
+
+# "article" retrieves candidates per article batch, "corpus" shortlists candidates for
+# every article with blocked matrix products before reranking in large batches
+MATCH_MODE = os.getenv("RAG_MATCH_MODE", "article")
+CORPUS_BLOCK_SIZE = 4096
+CORPUS_RERANK_BATCH_SIZE = 512
+
+# Worker processes for matching; each gets its own models and cpu_count / RAG_WORKERS
+# torch or ONNX Runtime threads unless RAG_THREADS_PER_WORKER is set
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", "1"))
+RAG_THREADS_PER_WORKER = int(os.getenv("RAG_THREADS_PER_WORKER", "0"))
 
 # Proven set of BU IDs to include
 loanIds = set([
@@ -63,97 +102,177 @@ def load_chroma_collection():
     chroma_client = chromadb.PersistentClient(CHROMA_PATH)
     return chroma_client.get_or_create_collection("projects", metadata={"hnsw:space": "cosine"})
 
-def insert_projects_into_chroma(csv_df, model):
+def project_fingerprint(text, metadata):
+    # Includes the inference backend so switching it re-embeds the projects
+    payload = text + json.dumps(metadata, sort_keys=True, default=str) + INFERENCE_BACKEND
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def insert_projects_into_chroma(csv_df, model, batch_size=INGEST_BATCH_SIZE):
+    """
+    Brings the collection in line with the CSV: upserts projects whose text or
+    metadata changed since they were stored (tracked by a fingerprint in their
+    metadata) and deletes projects that are no longer in loanIds. Only the
+    upserted rows are embedded.
+    """
     csv_df = csv_df[csv_df["BU ID"].isin(loanIds) & csv_df["BU ID"].notna()]
     csv_df = csv_df.drop_duplicates(subset="BU ID")
-    if os.path.exists(CHROMA_CACHE_PATH):
-        print("📁 Skipping ChromaDB insert — already cached")
-        return
     collection = load_chroma_collection()
-    texts = [build_project_text(row) for _, row in csv_df.iterrows()]
-    embeddings = model.encode(texts, normalize_embeddings=True)
-    ids = [str(row["BU ID"]) for _, row in csv_df.iterrows()]
-    metadatas = [
-        {"BU ID": str(row["BU ID"]), "Project Name": row.get("Project Name", ""), "Country": row.get("Country", "")}
-        for _, row in csv_df.iterrows()
-    ]
-    collection.add(ids=ids, documents=texts, embeddings=embeddings, metadatas=metadatas)
-    with open(CHROMA_CACHE_PATH, "w") as f:
-        f.write("inserted")
-    print(f"🎉 Inserted {len(ids)} projects into ChromaDB")
 
-def fetch_all_articles(page_size=100, max_records=50000):
+    existing = collection.get(include=["metadatas"])
+    stored = {
+        buid: (meta or {}).get("fingerprint")
+        for buid, meta in zip(existing["ids"], existing["metadatas"])
+    }
+
+    changed = []
+    current_ids = set()
+    for _, row in csv_df.iterrows():
+        buid = str(row["BU ID"])
+        current_ids.add(buid)
+        text = build_project_text(row)
+        metadata = {"BU ID": buid, "Project Name": row.get("Project Name", ""), "Country": row.get("Country", "")}
+        metadata["fingerprint"] = project_fingerprint(text, metadata)
+        if stored.get(buid) != metadata["fingerprint"]:
+            changed.append((buid, text, metadata))
+
+    stale = [buid for buid in stored if buid not in current_ids]
+    if stale:
+        collection.delete(ids=stale)
+
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start + batch_size]
+        ids, texts, metadatas = (list(column) for column in zip(*batch))
+        embeddings = model.encode(texts, batch_size=ENCODE_BATCH_SIZE, normalize_embeddings=True)
+        collection.upsert(ids=ids, documents=texts, embeddings=embeddings, metadatas=metadatas)
+
+    if changed or stale:
+        print(f"🎉 Upserted {len(changed)} and removed {len(stale)} projects in ChromaDB ({len(current_ids)} total)")
+    else:
+        print(f"📁 ChromaDB projects up to date ({len(current_ids)} total)")
+
+def fetch_all_articles(page_size=100, max_records=50000, pagination=PAGINATION):
     db_url = os.getenv("NOCO_DB_URL")
     headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
-    offset = 0
-    fetched = 0
-    while True:
-        params = {
-            "fields": "Id,BU ID,translatedTitle,webScrapedContent,translatedContent,originalTitle,originalContent,source,AIScore4_Justification,a,b,c,d",
-            "offset": offset,
-            "limit": page_size,
-            "where": "(BU ID,isnot,null)",
-        }
-        response = requests.get(db_url, headers=headers, params=params)
-        if response.status_code != 200:
-            break
-        try:
-            data = response.json().get("list", [])
-        except Exception as e:
-            print(f"❌ Failed to decode JSON: {e}")
-            break
-        if not data:
-            break
-        for article in data:
-            yield article
-        offset += page_size
-        fetched += len(data)
-        if fetched >= max_records:
+    fields = "Id,BU ID,translatedTitle,webScrapedContent,translatedContent,originalTitle,originalContent,source,AIScore4_Justification,a,b,c,d"
+    mirror = ArticleMirror.open()
+    if mirror:
+        return iter(mirror.query("bu_id IS NOT NULL", order="Id", limit=max_records, fields=fields))
+    params = {
+        "fields": fields,
+        "where": "(BU ID,isnot,null)",
+    }
+    if pagination == "keyset":
+        return nocodb.fetch_rows_keyset(db_url, headers, params, page_size, max_records)
+    return nocodb.fetch_rows(db_url, headers, params, page_size, max_records, workers=FETCH_WORKERS)
+
+# (label, article field, weight) in the order they appear in the embedded text
+ARTICLE_FIELDS = [
+    ("Title", "translatedTitle", 3),
+    ("Content", "webScrapedContent", 2),
+    ("TranslatedContent", "translatedContent", 2),
+    ("OriginalContent", "originalContent", 1),
+    ("OriginalTitle", "originalTitle", 3),
+    ("Country", "a", 4),
+    ("Lender", "b", 4),
+    ("Keywords", "c", 4),
+    ("Project", "d", 4),
+    ("AIJustification", "AIScore4_Justification", 1),
+    ("Source", "source", 1),
+]
+
+def allocate_tokens(needs, weights, budget):
+    """
+    Splits `budget` tokens across fields in proportion to their weights. Fields
+    needing less than their share keep what they need and the rest is shared
+    among the remaining fields.
+    """
+    allocation = {}
+    pending = set(needs)
+    remaining = budget
+    while pending:
+        share = remaining / sum(weights[f] for f in pending)
+        satisfied = {f for f in pending if needs[f] <= share * weights[f]}
+        if not satisfied:
+            for f in pending:
+                allocation[f] = int(share * weights[f])
             break
+        for f in satisfied:
+            allocation[f] = needs[f]
+            remaining -= needs[f]
+        pending -= satisfied
+    return allocation
 
-def weighted_article_text(article):
-    # Use field names for context and concatenate all relevant fields
-    parts = []
-    if article.get("translatedTitle"):
-        parts.append("Title: " + article.get("translatedTitle") * 3)
-    if article.get("webScrapedContent"):
-        parts.append("Content: " + article.get("webScrapedContent") * 2)
-    if article.get("translatedContent"):
-        parts.append("TranslatedContent: " + article.get("translatedContent") * 2)
-    if article.get("originalContent"):
-        parts.append("OriginalContent: " + article.get("originalContent"))
-    if article.get("originalTitle"):
-        parts.append("OriginalTitle: " + article.get("originalTitle") * 3)
-    if article.get("a"):
-        parts.append("Country: " + article.get("a") * 4)
-    if article.get("b"):
-        parts.append("Lender: " + article.get("b") * 4)
-    if article.get("c"):
-        parts.append("Keywords: " + article.get("c") * 4)
-    if article.get("d"):
-        parts.append("Project: " + article.get("d") * 4)
-    if article.get("AIScore4_Justification"):
-        parts.append("AIJustification: " + article.get("AIScore4_Justification"))
-    if article.get("source"):
-        parts.append("Source: " + article.get("source"))
+def weighted_article_text(article, tokenizer, budget=ARTICLE_TOKEN_BUDGET):
+    """
+    Builds the embedded article text within `budget` tokens. Each field gets a
+    share of the budget by weight: short fields are repeated up to `weight` times
+    to emphasise them, long fields are cut to their share, so the text stays within
+    what the model reads instead of being truncated after the first field.
+    """
+    fields = [
+        (label, str(article[key]).strip(), weight)
+        for label, key, weight in ARTICLE_FIELDS
+        if article.get(key) and str(article[key]).strip()
+    ]
+    if not fields:
+        return ""
+
+    # Reserve room for the special tokens and each field's label and separator
+    available = max(budget - 2 - 4 * len(fields), len(fields))
+    # No field can use more tokens than the budget, so there is no need to tokenize more text than that
+    tokens = {label: tokenizer.tokenize(text[:available * 8]) for label, text, _ in fields}
+    # Text the tokenizer drops entirely, such as stray control characters, adds nothing to embed
+    fields = [(label, text, weight) for label, text, weight in fields if tokens[label]]
+    if not fields:
+        return ""
+    weights = {label: weight for label, _, weight in fields}
+    allocation = allocate_tokens(
+        {label: len(tokens[label]) * weights[label] for label, _, _ in fields},
+        weights,
+        available,
+    )
 
+    parts = []
+    for label, text, weight in fields:
+        field_tokens = tokens[label]
+        repeats = min(weight, allocation[label] // len(field_tokens))
+        if repeats:
+            value = " ".join([text] * repeats)
+        else:
+            value = tokenizer.convert_tokens_to_string(field_tokens[:allocation[label]])
+        parts.append(f"{label}: {value}")
     return " | ".join(parts)
 
-def rerank(article_text, candidates, article_country):
-    reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
-    scored = []
-    for c in candidates:
-        buid_country = c["article"].get("Country", "")
-        base_score = reranker.predict([(article_text, c["document"])])[0]
-        if buid_country and article_country:
-            if buid_country.strip().lower() == article_country.strip().lower():
-                base_score += 0.05
-            else:
-                base_score -= 0.1
-        c["rerank_score"] = float(base_score)
-        c["buid"] = c["article"].get("BU ID")
-        scored.append(c)
-    return sorted(scored, key=lambda x: x["rerank_score"], reverse=True)
+def rerank(reranker, article_texts, candidate_lists, article_countries):
+    """
+    Scores every (article, candidate) pair of a batch of articles with a single
+    cross-encoder predict call, then returns each article's candidates sorted by
+    rerank score.
+    """
+    pairs = [
+        (article_text, c["document"])
+        for article_text, candidates in zip(article_texts, candidate_lists)
+        for c in candidates
+    ]
+    scores = reranker.predict(pairs, batch_size=RERANK_BATCH_SIZE) if pairs else []
+
+    reranked = []
+    offset = 0
+    for candidates, article_country in zip(candidate_lists, article_countries):
+        scored = []
+        for c, base_score in zip(candidates, scores[offset:offset + len(candidates)]):
+            buid_country = c["article"].get("Country", "")
+            if buid_country and article_country:
+                if buid_country.strip().lower() == article_country.strip().lower():
+                    base_score += 0.05
+                else:
+                    base_score -= 0.1
+            c["rerank_score"] = float(base_score)
+            c["buid"] = c["article"].get("BU ID")
+            scored.append(c)
+        offset += len(candidates)
+        reranked.append(sorted(scored, key=lambda x: x["rerank_score"], reverse=True))
+    return reranked
 
 def patch_article_buid(article_id, buids_and_scores):
     db_url = os.getenv("NOCO_DB_URL")
@@ -176,11 +295,76 @@ def load_articles_from_disk(path=CACHE_PATH):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
+def load_retriever(backend, collection, csv_df):
+    if backend == "chroma":
+        return ChromaRetriever(collection, csv_df)
+    if backend == "faiss":
+        # Imported here so faiss is only loaded when selected
+        from faiss_index import FaissIndex
+        return FaissIndex.load_or_build(collection, FAISS_INDEX_PATH)
+    print("🗂️ Building per-country project index...")
+    return ProjectIndex.from_collection(collection)
+
+def embed_articles(articles, model, cache):
+    """Embeddings for `articles`, encoding only those not in the embedding cache."""
+    texts = [weighted_article_text(article, model.tokenizer, model.max_seq_length) for article in articles]
+    embeddings = cache.encode(
+        [article["Id"] for article in articles],
+        texts,
+        lambda missing: model.encode(missing, batch_size=ENCODE_BATCH_SIZE, normalize_embeddings=True),
+    )
+    cache.compact()
+    return texts, embeddings
+
+def match_articles(articles, article_texts, embeddings, reranker, retriever):
+    """
+    Matches a batch of articles to their top 5 BU IDs, reranking all candidate
+    pairs of the batch in one pass.
+    Returns [(article_id, [(buid, score), ...]), ...] for articles with matches.
+    """
+    # Search only loans from the article's country
+    candidate_lists = [
+        retriever.search(embedding, article.get("a"), N_RESULTS)
+        for article, embedding in zip(articles, embeddings)
+    ]
+    return rerank_matches(articles, article_texts, candidate_lists, reranker)
+
+def rerank_matches(articles, article_texts, candidate_lists, reranker):
+    reranked = rerank(reranker, article_texts, candidate_lists, [article.get("a") for article in articles])
+    matches = []
+    for article, candidates in zip(articles, reranked):
+        top_matches = [(r["buid"], r["rerank_score"]) for r in candidates][:5]
+        if top_matches:
+            matches.append((article.get("Id"), top_matches))
+    return matches
+
+# Reranker and project data loaded once per worker process
+_worker = {}
+
+def _init_worker(threads, retriever):
+    # Caps OpenMP pools too, for libraries that read it when first loaded
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    torch.set_num_threads(threads)
+    _worker["reranker"] = inference.load_reranker(INFERENCE_BACKEND, threads)
+    # Chroma clients and FAISS indexes cannot be pickled; workers open their own,
+    # and the saved FAISS index is memory-mapped so its pages are shared
+    if retriever is None and MATCH_MODE != "corpus":
+        retriever = load_retriever(RETRIEVAL_BACKEND, load_chroma_collection(), pd.read_csv(CSV_PATH))
+    _worker["retriever"] = retriever
+
+def _match_in_worker(batch):
+    if MATCH_MODE == "corpus":
+        # Batches already carry their shortlisted candidates
+        return rerank_matches(*batch, _worker["reranker"])
+    return match_articles(*batch, _worker["reranker"], _worker["retriever"])
+
 def main():
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+    model = inference.load_embedding_model(INFERENCE_BACKEND)
+    reranker = inference.load_reranker(INFERENCE_BACKEND)
     csv_df = pd.read_csv(CSV_PATH)
     insert_projects_into_chroma(csv_df, model)
     collection = load_chroma_collection()
+    retriever = load_retriever(RETRIEVAL_BACKEND, collection, csv_df)
 
     if os.path.exists(CACHE_PATH):
         print("📁 Loading articles from disk...")
@@ -191,41 +375,61 @@ def main():
         save_articles_to_disk(articles)
     print(f"✅ Retrieved {len(articles)} articles")
 
-    matched_count = 0
-    for idx, article in enumerate(articles):
-        article_id = article.get("Id")
-        article_country = article.get("a")
-        print(f"🔎 Processing article {idx+1}/{len(articles)}")
-        if not article_id or not article_country:
-            continue
-
-        # Filter loans by country - exact match since we're using standardized country names
-        country_loans = csv_df[csv_df["Country"].str.strip().str.lower() == article_country.strip().lower()]
-        country_buids = set(country_loans["BU ID"].dropna().astype(str))
-        if not country_buids:
-            continue
-
-        article_text = weighted_article_text(article)
-        embedding = model.encode([article_text], normalize_embeddings=True)
-
-        # Query only loans from that country with more candidates
-        results = collection.query(
-            query_embeddings=embedding,
-            n_results=75,  # Increased from 50 to 75 to get even more candidates
-            where={"BU ID": {"$in": list(country_buids)}},
-            include=["metadatas", "documents", "distances"]
+    eligible = [
+        article for article in articles
+        if article.get("Id") and article.get("a") and retriever.has_country(article.get("a"))
+    ]
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH, f"{inference.EMBEDDING_MODEL_NAME}:{INFERENCE_BACKEND}", model.get_sentence_embedding_dimension())
+    article_texts, embeddings = embed_articles(eligible, model, cache)
+
+    if MATCH_MODE == "corpus":
+        project_index = retriever if isinstance(retriever, ProjectIndex) else ProjectIndex.from_collection(collection)
+        print(f"🧮 Shortlisting {N_RESULTS} projects for {len(eligible)} articles in one pass...")
+        per_article = project_index.search_all(
+            embeddings, [article["a"] for article in eligible], N_RESULTS, CORPUS_BLOCK_SIZE
         )
+        batch_size = CORPUS_RERANK_BATCH_SIZE
+    else:
+        per_article = embeddings
+        batch_size = MATCH_BATCH_SIZE
 
-        candidates = [
-            {"score": 1 - dist, "article": meta, "document": doc}
-            for meta, doc, dist in zip(results["metadatas"][0], results["documents"][0], results["distances"][0])
-        ]
+    batches = [
+        (eligible[start:start + batch_size], article_texts[start:start + batch_size], per_article[start:start + batch_size])
+        for start in range(0, len(eligible), batch_size)
+    ]
+    if RAG_WORKERS > 1:
+        threads = RAG_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // RAG_WORKERS)
+        print(f"🧵 Matching with {RAG_WORKERS} worker processes, {threads} threads each")
+        pool = multiprocessing.get_context("spawn").Pool(
+            RAG_WORKERS,
+            initializer=_init_worker,
+            initargs=(threads, retriever if RETRIEVAL_BACKEND == "index" else None),
+        )
+        results = pool.imap(_match_in_worker, batches)
+    else:
+        pool = None
+        results = (
+            rerank_matches(*batch, reranker) if MATCH_MODE == "corpus" else match_articles(*batch, reranker, retriever)
+            for batch in batches
+        )
 
-        reranked = rerank(article_text, candidates, article_country)
-        top_matches = [(r["buid"], r["rerank_score"]) for r in reranked][:5]
-        if top_matches:
-            patch_article_buid(article_id, top_matches)
-            matched_count += 1
+    matched_count = 0
+    processed = 0
+    try:
+        # imap yields batches in submission order, so patches go out in article order
+        for batch, matches in zip(batches, results):
+            processed += len(batch[0])
+            print(f"🔎 Processed {processed}/{len(eligible)} articles")
+            for article_id, top_matches in matches:
+                patch_article_buid(article_id, top_matches)
+                matched_count += 1
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        # Stops the workers when matching or patching fails part way through
+        if pool:
+            pool.terminate()
 
     print(f"📤 Done updating matched BU IDs. Matched {matched_count}/{len(articles)} articles.")
 
@@ -0,0 +1,217 @@
+"""
+Benchmarks for the rag matcher, run inside the rag container against the
+cached articles in /app/output:
+
+    python benchmark.py backends --sample 500
+    python benchmark.py retrieval --sample 500
+    python benchmark.py depth --depths 25 50 75 100
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+import app
+import inference
+from project_index import ProjectIndex
+
+
+def load_sample(sample, seed=0):
+    articles = [
+        article for article in app.load_articles_from_disk(app.CACHE_PATH)
+        if article.get("Id") and article.get("a")
+    ]
+    if sample and sample < len(articles):
+        articles = random.Random(seed).sample(articles, sample)
+    return articles
+
+
+def build_project_index(model, collection):
+    # Projects are embedded with the model under test so both sides use the same backend
+    data = collection.get(include=["documents", "metadatas"])
+    embeddings = model.encode(data["documents"], batch_size=app.ENCODE_BATCH_SIZE, normalize_embeddings=True)
+    return ProjectIndex(data["ids"], embeddings, data["documents"], data["metadatas"])
+
+
+def run_backend(backend, articles, collection):
+    model = inference.load_embedding_model(backend)
+    reranker = inference.load_reranker(backend)
+    index = build_project_index(model, collection)
+
+    eligible = [article for article in articles if index.has_country(article["a"])]
+    texts = [app.weighted_article_text(article, model.tokenizer, model.max_seq_length) for article in eligible]
+
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=app.ENCODE_BATCH_SIZE, normalize_embeddings=True)
+    encode_seconds = time.perf_counter() - start
+
+    candidate_lists = [
+        index.search(embedding, article["a"], app.N_RESULTS)
+        for article, embedding in zip(eligible, embeddings)
+    ]
+    pairs = sum(len(candidates) for candidates in candidate_lists)
+
+    start = time.perf_counter()
+    reranked = app.rerank(reranker, texts, candidate_lists, [article["a"] for article in eligible])
+    rerank_seconds = time.perf_counter() - start
+
+    return {
+        "top5": {
+            article["Id"]: [c["buid"] for c in candidates[:5]]
+            for article, candidates in zip(eligible, reranked)
+        },
+        "articles": len(eligible),
+        "encode_per_second": len(eligible) / max(encode_seconds, 1e-9),
+        "pairs_per_second": pairs / max(rerank_seconds, 1e-9),
+    }
+
+
+def compare_top5(reference, result):
+    ids = [article_id for article_id in reference if reference[article_id] and article_id in result]
+    if not ids:
+        return 0.0, 0.0
+    top1 = sum(result[i][:1] == reference[i][:1] for i in ids) / len(ids)
+    overlap = sum(len(set(result[i]) & set(reference[i])) / len(reference[i]) for i in ids) / len(ids)
+    return top1, overlap
+
+
+def benchmark_backends(args):
+    articles = load_sample(args.sample)
+    collection = app.load_chroma_collection()
+    print(f"📊 Comparing inference backends on {len(articles)} articles")
+
+    reference = None
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        result = run_backend(backend, articles, collection)
+        reference = reference or result
+        top1, overlap = compare_top5(reference["top5"], result["top5"])
+        print(
+            f"{backend:>10}: {result['encode_per_second']:8.1f} articles/s encode, "
+            f"{result['pairs_per_second']:8.1f} pairs/s rerank, "
+            f"top-1 agreement {top1:.1%}, top-5 overlap {overlap:.1%} vs torch"
+        )
+
+
+def benchmark_retrieval(args):
+    collection = app.load_chroma_collection()
+    csv_df = pd.read_csv(app.CSV_PATH)
+    model = inference.load_embedding_model(app.INFERENCE_BACKEND)
+    articles = load_sample(args.sample)
+    texts = [app.weighted_article_text(article, model.tokenizer, model.max_seq_length) for article in articles]
+    embeddings = model.encode(texts, batch_size=app.ENCODE_BATCH_SIZE, normalize_embeddings=True)
+    print(f"📊 Comparing retrieval backends on {len(articles)} articles, n_results={args.n_results}")
+
+    reference = None
+    for backend in ["chroma"] + [b for b in args.backends if b != "chroma"]:
+        start = time.perf_counter()
+        retriever = app.load_retriever(backend, collection, csv_df)
+        startup_seconds = time.perf_counter() - start
+
+        latencies = []
+        results = {}
+        for article, embedding in zip(articles, embeddings):
+            if not retriever.has_country(article["a"]):
+                continue
+            start = time.perf_counter()
+            candidates = retriever.search(embedding, article["a"], args.n_results)
+            latencies.append(time.perf_counter() - start)
+            results[article["Id"]] = {c["article"].get("BU ID") for c in candidates}
+
+        reference = reference or results
+        shared = [i for i in reference if i in results and reference[i]]
+        agreement = sum(len(results[i] & reference[i]) / len(reference[i]) for i in shared) / max(len(shared), 1)
+        latencies_ms = np.array(latencies or [0.0]) * 1000
+        print(
+            f"{backend:>7}: startup {startup_seconds:6.2f}s, query mean {latencies_ms.mean():7.2f}ms "
+            f"p95 {np.percentile(latencies_ms, 95):7.2f}ms, candidate overlap {agreement:.1%} vs chroma"
+        )
+
+
+def load_labels(articles, path=None):
+    """
+    Labeled article -> BU IDs pairs. Defaults to the BU ID already recorded on the
+    cached articles; a CSV with Id and BU ID columns can be given instead.
+    """
+    if path:
+        labels_df = pd.read_csv(path, dtype=str)
+        pairs = zip(labels_df["Id"], labels_df["BU ID"])
+    else:
+        pairs = ((str(article["Id"]), article.get("BU ID")) for article in articles)
+
+    labels = {}
+    for article_id, buids in pairs:
+        if isinstance(buids, str) and buids.strip():
+            labels.setdefault(str(article_id), set()).update(b.strip() for b in buids.split(",") if b.strip())
+    return labels
+
+
+def benchmark_depth(args):
+    collection = app.load_chroma_collection()
+    csv_df = pd.read_csv(app.CSV_PATH)
+    model = inference.load_embedding_model(app.INFERENCE_BACKEND)
+    reranker = inference.load_reranker(app.INFERENCE_BACKEND)
+
+    articles = load_sample(0)
+    labels = load_labels(articles, args.labels)
+    articles = [article for article in articles if str(article["Id"]) in labels]
+    if args.sample and args.sample < len(articles):
+        articles = random.Random(0).sample(articles, args.sample)
+    texts = [app.weighted_article_text(article, model.tokenizer, model.max_seq_length) for article in articles]
+    embeddings = model.encode(texts, batch_size=app.ENCODE_BATCH_SIZE, normalize_embeddings=True)
+    print(f"📊 Candidate depth on {len(articles)} labeled articles")
+
+    for backend in args.backends:
+        retriever = app.load_retriever(backend, collection, csv_df)
+        for depth in args.depths:
+            retrieved = correct = evaluated = 0
+            seconds = 0.0
+            for article, text, embedding in zip(articles, texts, embeddings):
+                if not retriever.has_country(article["a"]):
+                    continue
+                truth = labels[str(article["Id"])]
+                start = time.perf_counter()
+                candidates = retriever.search(embedding, article["a"], depth)
+                reranked = app.rerank(reranker, [text], [candidates], [article["a"]])[0]
+                seconds += time.perf_counter() - start
+
+                evaluated += 1
+                retrieved += any(c["article"].get("BU ID") in truth for c in candidates)
+                correct += any(c["buid"] in truth for c in reranked[:5])
+
+            print(
+                f"{backend:>7} n_results={depth:<4} recall@{depth} {retrieved / max(evaluated, 1):6.1%}  "
+                f"top-5 accuracy {correct / max(evaluated, 1):6.1%}  "
+                f"{1000 * seconds / max(evaluated, 1):8.1f} ms/article"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backends = commands.add_parser("backends", help="accuracy and throughput of the inference backends")
+    backends.add_argument("--sample", type=int, default=500)
+    backends.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"], choices=inference.BACKENDS)
+    backends.set_defaults(run=benchmark_backends)
+
+    retrieval = commands.add_parser("retrieval", help="startup time and query latency of the retrieval backends")
+    retrieval.add_argument("--sample", type=int, default=500)
+    retrieval.add_argument("--n-results", type=int, default=app.N_RESULTS)
+    retrieval.add_argument("--backends", nargs="+", default=["index", "faiss"], choices=["chroma", "index", "faiss"])
+    retrieval.set_defaults(run=benchmark_retrieval)
+
+    depth = commands.add_parser("depth", help="recall, top-5 accuracy and latency across n_results values")
+    depth.add_argument("--sample", type=int, default=500)
+    depth.add_argument("--labels", help="CSV of Id,BU ID pairs; defaults to the BU IDs on the cached articles")
+    depth.add_argument("--depths", nargs="+", type=int, default=[10, 25, 50, 75, 100])
+    depth.add_argument("--backends", nargs="+", default=["index"], choices=["chroma", "index", "faiss"])
+    depth.set_defaults(run=benchmark_depth)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent article embeddings: a float32 matrix on disk, memory-mapped for
+    reads, and a JSON index from article Id to its row and the hash of the text
+    that row was computed from. Only articles that are new or whose text changed
+    are encoded; edited articles get a new row and the old one is dropped the
+    next time the matrix is compacted. Lookups copy the requested rows out of
+    the memory map, so only the matrix as a whole stays out of memory.
+
+    New rows are flushed to disk before the index that points to them is
+    written, and a matrix left with a partial row by an interrupted append is
+    truncated to whole rows when the cache is opened.
+    """
+
+    def __init__(self, directory, model_name, dim):
+        self.matrix_path = os.path.join(directory, "embeddings.f32")
+        self.index_path = os.path.join(directory, "index.json")
+        self.model_name = model_name
+        self.dim = dim
+        os.makedirs(directory, exist_ok=True)
+
+        self.index = {}
+        self.rows = 0
+        if os.path.exists(self.index_path) and os.path.exists(self.matrix_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            # Vectors from another model or dimension cannot be reused
+            if stored.get("model") == model_name and stored.get("dim") == dim:
+                row_size = 4 * dim
+                size = os.path.getsize(self.matrix_path)
+                self.rows = size // row_size
+                if size % row_size:
+                    print(f"⚠️ Dropping a partially written row from {self.matrix_path}")
+                    os.truncate(self.matrix_path, self.rows * row_size)
+                self.index = {key: entry for key, entry in stored["index"].items() if entry[0] < self.rows}
+
+    def _matrix(self):
+        if self.rows == 0:
+            return np.empty((0, self.dim), dtype="float32")
+        return np.memmap(self.matrix_path, dtype="float32", mode="r", shape=(self.rows, self.dim))
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "index": self.index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def encode(self, ids, texts, encode_fn):
+        """
+        Returns a (len(ids), dim) float32 matrix of embeddings for `texts`,
+        calling `encode_fn` only for the texts missing from the cache.
+        """
+        keys = [str(article_id) for article_id in ids]
+        hashes = [text_hash(text) for text in texts]
+        missing = [
+            i for i, (key, digest) in enumerate(zip(keys, hashes))
+            if self.index.get(key, (None, None))[1] != digest
+        ]
+
+        if missing:
+            vectors = np.asarray(encode_fn([texts[i] for i in missing]), dtype="float32")
+            mode = "ab" if self.rows else "wb"
+            with open(self.matrix_path, mode) as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            for offset, i in enumerate(missing):
+                self.index[keys[i]] = (self.rows + offset, hashes[i])
+            self.rows += len(missing)
+            self._save_index()
+
+        print(f"🧠 Encoded {len(missing)} articles, reused {len(keys) - len(missing)} cached embeddings")
+        rows = [self.index[key][0] for key in keys]
+        return np.asarray(self._matrix()[rows])
+
+    def compact(self, max_unused=0.5):
+        """Rewrites the matrix without rows no article points to anymore."""
+        if self.rows == 0 or 1 - len(self.index) / self.rows <= max_unused:
+            return
+        matrix = self._matrix()
+        keys = list(self.index.keys())
+        kept = np.asarray(matrix[[self.index[key][0] for key in keys]])
+        del matrix
+
+        tmp_path = self.matrix_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(kept.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.matrix_path)
+        self.index = {key: (row, self.index[key][1]) for row, key in enumerate(keys)}
+        self.rows = len(keys)
+        self._save_index()
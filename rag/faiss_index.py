@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+import faiss
+import numpy as np
+
+from project_index import format_candidates, normalize_country
+
+# Memory-map the flat vectors when this faiss version supports it
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def collection_fingerprint(ids, metadatas):
+    stored = sorted((buid, (meta or {}).get("fingerprint", "")) for buid, meta in zip(ids, metadatas))
+    return hashlib.sha1(json.dumps(stored).encode("utf-8")).hexdigest()
+
+
+class FaissIndex:
+    """
+    Project embeddings in a flat inner-product FAISS index saved to disk and
+    memory-mapped on load. Projects are stored grouped by country, so a
+    country-restricted search is an IDSelectorRange over that country's rows.
+    Document and metadata lookups live in a JSON file next to the index.
+    """
+
+    def __init__(self, index, meta):
+        self.index = index
+        self.documents = meta["documents"]
+        self.metadatas = meta["metadatas"]
+        self.ranges = meta["ranges"]
+        self.fingerprint = meta["fingerprint"]
+
+    @classmethod
+    def build(cls, collection, path):
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        order = sorted(
+            (i for i, meta in enumerate(data["metadatas"]) if meta.get("Country")),
+            key=lambda i: normalize_country(data["metadatas"][i]["Country"]),
+        )
+        embeddings = np.ascontiguousarray(np.asarray(data["embeddings"], dtype="float32")[order])
+
+        ranges = {}
+        for row, i in enumerate(order):
+            country = normalize_country(data["metadatas"][i]["Country"])
+            start, _ = ranges.get(country, (row, row))
+            ranges[country] = (start, row + 1)
+
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+        meta = {
+            "documents": [data["documents"][i] for i in order],
+            "metadatas": [data["metadatas"][i] for i in order],
+            "ranges": ranges,
+            "fingerprint": collection_fingerprint(data["ids"], data["metadatas"]),
+        }
+
+        os.makedirs(path, exist_ok=True)
+        faiss.write_index(index, os.path.join(path, "projects.faiss"))
+        with open(os.path.join(path, "projects.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, default=str)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        index = faiss.read_index(os.path.join(path, "projects.faiss"), MMAP_FLAGS)
+        with open(os.path.join(path, "projects.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(index, meta)
+
+    @classmethod
+    def load_or_build(cls, collection, path):
+        """Loads the saved index, rebuilding it when the collection has changed since."""
+        if os.path.exists(os.path.join(path, "projects.json")):
+            current = collection.get(include=["metadatas"])
+            index = cls.load(path)
+            if index.fingerprint == collection_fingerprint(current["ids"], current["metadatas"]):
+                return index
+        print("🗂️ Building FAISS project index...")
+        return cls.build(collection, path)
+
+    def has_country(self, country):
+        return normalize_country(country) in self.ranges
+
+    def search(self, embedding, country, n_results):
+        country_range = self.ranges.get(normalize_country(country))
+        if country_range is None:
+            return []
+
+        start, end = country_range
+        params = faiss.SearchParameters(sel=faiss.IDSelectorRange(start, end))
+        query = np.asarray(embedding, dtype="float32").reshape(1, -1)
+        scores, rows = self.index.search(query, min(n_results, end - start), params=params)
+        hits = [(row, score) for row, score in zip(rows[0], scores[0]) if row >= 0]
+        return format_candidates(
+            [self.metadatas[row] for row, _ in hits],
+            [self.documents[row] for row, _ in hits],
+            [score for _, score in hits],
+        )
@@ -0,0 +1,53 @@
+import os
+
+from sentence_transformers import CrossEncoder, SentenceTransformer, export_dynamic_quantized_onnx_model
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+RERANKER_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+ONNX_MODEL_DIR = "/app/output/onnx"
+# onnxruntime dynamic quantization target: "avx512_vnni", "avx512", "avx2" or "arm64"
+QUANTIZATION_CONFIG = os.getenv("RAG_QUANTIZATION_CONFIG", "avx2")
+
+# "torch" runs the models in full precision PyTorch, "onnx" through ONNX Runtime,
+# "onnx-int8" through ONNX Runtime with int8 dynamically quantized weights.
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def _session_options(threads):
+    # ONNX Runtime sizes its own thread pool and ignores torch.set_num_threads
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    return options
+
+
+def _load(model_class, name, backend, threads=None):
+    if backend == "torch":
+        return model_class(name)
+    # `threads` caps ONNX Runtime's thread pool; None keeps its default of one thread per core
+    model_kwargs = {"session_options": _session_options(threads)} if threads else {}
+    if backend == "onnx":
+        return model_class(name, backend="onnx", model_kwargs=model_kwargs)
+    if backend != "onnx-int8":
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+
+    # Quantize once and keep the result next to the exported model for later runs
+    path = os.path.join(ONNX_MODEL_DIR, name.replace("/", "__"))
+    file_name = f"onnx/model_qint8_{QUANTIZATION_CONFIG}.onnx"
+    if not os.path.exists(os.path.join(path, file_name)):
+        print(f"⚙️ Exporting int8 ONNX model for {name} ({QUANTIZATION_CONFIG})...")
+        model = model_class(name, backend="onnx")
+        model.save_pretrained(path)
+        export_dynamic_quantized_onnx_model(model, QUANTIZATION_CONFIG, path)
+    return model_class(path, backend="onnx", model_kwargs={"file_name": file_name, **model_kwargs})
+
+
+def load_embedding_model(backend, threads=None):
+    return _load(SentenceTransformer, EMBEDDING_MODEL_NAME, backend, threads)
+
+
+def load_reranker(backend, threads=None):
+    return _load(CrossEncoder, RERANKER_NAME, backend, threads)
@@ -0,0 +1,134 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+def normalize_country(country):
+    return str(country).strip().lower()
+
+
+def format_candidates(metadatas, documents, scores):
+    return [
+        {"score": float(score), "article": meta, "document": doc}
+        for meta, doc, score in zip(metadatas, documents, scores)
+    ]
+
+
+class ProjectIndex:
+    """
+    Project embeddings grouped by normalized country. A country-restricted search
+    is a dot product against that country's block of normalized embeddings, which
+    is the cosine similarity Chroma reports as 1 - distance.
+    """
+
+    def __init__(self, ids, embeddings, documents, metadatas):
+        rows = defaultdict(list)
+        for i, meta in enumerate(metadatas):
+            if meta.get("Country"):
+                rows[normalize_country(meta["Country"])].append(i)
+
+        embeddings = np.asarray(embeddings, dtype="float32")
+        self.countries = {}
+        for country, indices in rows.items():
+            self.countries[country] = {
+                "ids": [ids[i] for i in indices],
+                "embeddings": np.ascontiguousarray(embeddings[indices]),
+                "documents": [documents[i] for i in indices],
+                "metadatas": [metadatas[i] for i in indices],
+            }
+
+    @classmethod
+    def from_collection(cls, collection):
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        return cls(data["ids"], data["embeddings"], data["documents"], data["metadatas"])
+
+    def has_country(self, country):
+        return normalize_country(country) in self.countries
+
+    def search(self, embedding, country, n_results):
+        block = self.countries.get(normalize_country(country))
+        if block is None:
+            return []
+
+        scores = block["embeddings"] @ np.asarray(embedding, dtype="float32")
+        n_results = min(n_results, len(scores))
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top])]
+        return format_candidates(
+            [block["metadatas"][i] for i in top],
+            [block["documents"][i] for i in top],
+            scores[top],
+        )
+
+    def search_all(self, embeddings, countries, n_results, block_size=4096):
+        """
+        Country-restricted top `n_results` for every article at once: blocks of
+        article embeddings are multiplied against the full project matrix, projects
+        from other countries are masked out, and argpartition picks each row's top.
+        Returns one candidate list per article, in the same format as `search`.
+        """
+        names = list(self.countries)
+        codes = {country: code for code, country in enumerate(names)}
+        blocks = [self.countries[country] for country in names]
+        if not blocks:
+            # An empty collection has no projects to concatenate or shortlist
+            return [[] for _ in countries]
+        projects = np.concatenate([block["embeddings"] for block in blocks])
+        project_codes = np.concatenate([np.full(len(block["ids"]), codes[country]) for country, block in zip(names, blocks)])
+        documents = [doc for block in blocks for doc in block["documents"]]
+        metadatas = [meta for block in blocks for meta in block["metadatas"]]
+
+        embeddings = np.asarray(embeddings, dtype="float32")
+        article_codes = np.array([codes.get(normalize_country(country), -1) for country in countries])
+        k = min(n_results, len(projects))
+        results = []
+        for start in range(0, len(embeddings), block_size):
+            scores = embeddings[start:start + block_size] @ projects.T
+            codes_block = article_codes[start:start + block_size]
+            scores[codes_block[:, None] != project_codes[None, :]] = -np.inf
+
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            for rows, row_scores in zip(top, top_scores):
+                keep = np.isfinite(row_scores)
+                results.append(format_candidates(
+                    [metadatas[i] for i in rows[keep]],
+                    [documents[i] for i in rows[keep]],
+                    row_scores[keep],
+                ))
+        return results
+
+
+class ChromaRetriever:
+    """
+    Queries the Chroma collection with a BU ID filter. The country to BU ID map is
+    built once from the loan CSV instead of filtering the CSV for every article.
+    """
+
+    def __init__(self, collection, csv_df):
+        self.collection = collection
+        self.country_buids = defaultdict(list)
+        for country, buid in zip(csv_df["Country"], csv_df["BU ID"]):
+            if isinstance(country, str) and pd.notnull(buid):
+                self.country_buids[normalize_country(country)].append(str(buid))
+
+    def has_country(self, country):
+        return normalize_country(country) in self.country_buids
+
+    def search(self, embedding, country, n_results):
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=n_results,
+            where={"BU ID": {"$in": self.country_buids[normalize_country(country)]}},
+            include=["metadatas", "documents", "distances"]
+        )
+        return format_candidates(
+            results["metadatas"][0],
+            results["documents"][0],
+            [1 - dist for dist in results["distances"][0]],
+        )
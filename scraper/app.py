@@ -2,6 +2,7 @@ from flask import Flask
 from bs4 import BeautifulSoup
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime
+from collections import deque
 from dotenv import load_dotenv
 
 import json
@@ -10,6 +11,10 @@ import pytz
 import requests
 import re
 import os
+from article_mirror import ArticleMirror
+from work_queue import TRANSLATE, WorkQueue
+from rate_control import AdaptiveFetcher, CircuitOpenError, FetchError
+from job_runner import JobRunner
 
 app = Flask(__name__)
 scheduler = BackgroundScheduler()
@@ -44,6 +49,39 @@ def health_check():
     return "healthy"
 
 result_set = set()
+mirror = None
+queue = None
+fetcher = AdaptiveFetcher(timeout=15)
+# A term is dropped after being requeued this many times, and the run stops after this many circuit openings
+MAX_TERM_REQUEUES = 3
+MAX_CIRCUIT_OPENS = 10
+
+def article_exists(field, value):
+    if mirror:
+        return mirror.count(f"{field} = ?", (value,)) > 0
+    url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    req = requests.get(url, headers=headers, params={"where": f"({field},eq,{value})"})
+    return len(req.json()["list"]) > 0
+
+def latest_article_date(country_name):
+    if mirror:
+        rows = mirror.query(
+            "country = ? AND articlePublishDateEst < ?", (country_name, "2024-07-02"),
+            order="articlePublishDateEst DESC", limit=1, fields="articlePublishDateEst",
+        )
+        return rows[0].get("articlePublishDateEst") if rows else None
+    url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    date_params = {
+        "fields": "articlePublishDateEst",
+        "sort": "-articlePublishDateEst",
+        "where": f"(country,eq,{country_name})~and(articlePublishDateEst,lte,exactDate,2024-07-01)",
+        "limit": 1
+    }
+    rows = requests.get(url, headers=headers, params=date_params).json().get("list")
+    return rows[0].get("articlePublishDateEst") if len(rows) > 0 else None
+
 def scrape_country(country, latest_date, keywords):
     new_records = []
 
@@ -51,19 +89,9 @@ def scrape_country(country, latest_date, keywords):
     pageNum = 1
     while True:
         URL = get_target_url(country, keywords, latest_date, pageNum)
-        req_cnt = 0
-        timeout = True
-        page = None
-        while req_cnt < 5:
-            try:
-                page = requests.get(URL, timeout=15)   # request timeout after 15 seconds
-                timeout = False
-                break
-            except:
-                req_cnt += 1
-                print(f"[MOF Scraper] Request timeout for {URL}, retrying...")
-        
-        if timeout:
+        try:
+            page = fetcher.get(URL, attempts=5)
+        except FetchError:
             print(f"[MOF Scraper] Request failed for {URL}, skipping...")
             break
 
@@ -85,31 +113,14 @@ def scrape_country(country, latest_date, keywords):
             link = i.find("a").get("href")
 
             # check if article already exists in the database
-            url = os.getenv("NOCO_DB_URL")
-            headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
-            params = {
-                "where": f"(articleUrl,eq,{link})"
-            }
-
-            req = requests.get(url, headers=headers, params=params)
-            if len(req.json()["list"]) > 0:
+            if article_exists("articleUrl", link):
                 print(f"[MOF Scraper] Article {link} already exists in the database, skipping...")
                 continue
 
             # try to access article page
-            req_cnt = 0
-            timeout = True
-            article_page = None
-            while req_cnt < 3:
-                try:
-                    article_page = requests.get(link, timeout=15)   # request timeout after 15 seconds
-                    timeout = False
-                    break
-                except:
-                    req_cnt += 1
-                    print(f"[MOF Scraper] Request timeout for {link}, retrying...")
-
-            if timeout:
+            try:
+                article_page = fetcher.get(link, attempts=3)
+            except FetchError:
                 print(f"[MOF Scraper] Request failed for {link}, skipping...")
                 continue
             article = BeautifulSoup(article_page.content, "html.parser")
@@ -229,11 +240,21 @@ def scrape_country(country, latest_date, keywords):
 
     return new_records
 
-def scrape():
+def scrape(job=None):
+    global mirror, queue
+    mirror = ArticleMirror.open()
+    queue = WorkQueue.open()
     print("[MOF Scraper] Sraping started at " + datetime.now().isoformat() + "\n")
     ignore = ["CN", "HK", "MO", "TW"]   # ignore Mainland China, Hong Kong, Macau, and Taiwan
     start_scraping = False
     start_point = "IT"
+    circuit_opens = 0
+    # Failures are logged and skipped so the run gets through the other countries, then fail the job at the end
+    failures = []
+    if job:
+        countries = list(pycountry.countries)
+        start = [c.alpha_2 for c in countries].index(start_point)
+        job.set_total(len([c for c in countries[start:] if c.alpha_2 not in ignore]) * len(terms))
     for country in pycountry.countries:
         if country.alpha_2 == start_point:
             start_scraping = True
@@ -247,45 +268,63 @@ def scrape():
 
             # get latest date of article in the database
             date = ""
-            date_params = {
-                "fields": "articlePublishDateEst",
-                "sort": "-articlePublishDateEst",
-                "where": f"(country,eq,{country.name})~and(articlePublishDateEst,lte,exactDate,2024-07-01)",
-                "limit": 1
-            }
-            date_req = requests.get(url, headers=headers, params=date_params)
             try:
-                if len(date_req.json().get("list")) > 0:
-                    date_est = date_req.json().get("list")[0].get("articlePublishDateEst")
+                date_est = latest_article_date(country.name)
+                if date_est:
                     date_obj = datetime.fromisoformat(date_est)
                     beijing_time = date_obj.astimezone(beijing_tz)
                     date = beijing_time.strftime("%Y-%m-%d")
             except Exception as e:
                 print(f"[MOF Scraper] Failed to get latest date for {country.name}")
                 print(e)
+                failures.append(f"latest date for {country.name}: {e}")
                 continue
 
             print("[MOF Scraper] =====================================")
             print(f"[MOF Scraper] Scraping {country.name} from {date} CST...")
             timestart = datetime.now()
             articles = []
-            for term in terms:
+            pending = deque(terms)
+            requeues = {}
+            while pending:
+                term = pending.popleft()
                 country_code = country.alpha_2.lower()
-                articles.extend(scrape_country(country_code, date, "+".join(term.split(" "))))
+                seen = set(result_set)
+                try:
+                    articles.extend(scrape_country(country_code, date, "+".join(term.split(" "))))
+                except CircuitOpenError:
+                    # mofcom is struggling: forget this term's partial results, wait, and scrape it again later
+                    result_set.intersection_update(seen)
+                    circuit_opens += 1
+                    if circuit_opens >= MAX_CIRCUIT_OPENS:
+                        stopped = [term] + list(pending)
+                        print(f"[MOF Scraper] mofcom failed {circuit_opens} times, stopping the run; unscraped terms for {country.name}: {[t.strip() for t in stopped]}")
+                        break
+                    requeues[term] = requeues.get(term, 0) + 1
+                    if requeues[term] > MAX_TERM_REQUEUES:
+                        print(f"[MOF Scraper] Dropping term {term.strip()} for {country.name} after {MAX_TERM_REQUEUES} requeues")
+                    else:
+                        pending.append(term)
+                    fetcher.wait_until_closed()
+                    continue
+                if job:
+                    job.advance()
 
             for article in articles:
-                params = {
-                    "where": f"(originalTitle,eq,{article['originalTitle']})"
-                }
-                
                 # check if article already exists in the database
-                req = requests.get(url, headers=headers, params=params)
                 try:
-                    if len(req.json()["list"]) == 0:
-                        requests.post(url, headers=headers, json=article)
+                    if not article_exists("originalTitle", article["originalTitle"]):
+                        if mirror:
+                            res = mirror.write_through(url, headers, article, method="POST")
+                        else:
+                            res = requests.post(url, headers=headers, json=article)
+                        # hand the new record to the translator; blocks while its queue is full
+                        if queue and res.status_code == 200:
+                            queue.publish(TRANSLATE, [res.json()["Id"]])
                 except Exception as e:
                     print(f"[MOF Scraper] Failed to post article {article['originalTitle']} to the database")
                     print(e)
+                    failures.append(f"posting {article['originalTitle']}: {e}")
 
 
             timeend = datetime.now()
@@ -293,13 +332,21 @@ def scrape():
             print(f"\n[MOF Scraper] Scraped {len(articles)} articles from {country.name} in {timeend - timestart}")
 
             result_set.clear()
+
+            if circuit_opens >= MAX_CIRCUIT_OPENS:
+                raise RuntimeError(f"mofcom failed {circuit_opens} times, run stopped at {country.name}")
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} failures, the first was {failures[0]}")
             
 
 if __name__ == "__main__":
     load_dotenv()
-    # initial scrape, this process will take longer
+    runner = JobRunner(app, scheduler)
+    runner.register("scrape", scrape)
+    # runner.schedule("scrape", "cron", month="1,7", day="1", hour="0", minute="0")
+    scheduler.start()
+    # initial scrape, this process will take longer; progress is served at /jobs
     print("[MOF Scraper] Start inital scraping")
-    scrape()
-    # scheduler.add_job(scrape, "cron", month="1,7", day="1", hour="0", minute="0")
-    # scheduler.start()
+    runner.trigger("scrape")
     app.run(port=5001)
\ No newline at end of file
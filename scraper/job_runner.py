@@ -0,0 +1,163 @@
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import jsonify
+
+# Copied into the service directories from shared/ by shared/sync.py; edit shared/ and re-run it.
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job at its next progress update after it was cancelled. It is a
+    BaseException so the jobs' own `except Exception` handlers let it through.
+    """
+
+
+class Job:
+    """One run of a job, with the progress the job reports while it runs."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, name):
+        self.id = next(Job.ids)
+        self.name = name
+        self.status = "running"
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = 0
+        self.total = None
+        self.error = None
+        self.cancelled = threading.Event()
+
+    def set_total(self, total):
+        self.total = total
+
+    def advance(self, n=1):
+        self.done += n
+        self.check()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        throughput = self.done / elapsed if elapsed > 0 else 0
+        eta = None
+        if self.status == "running" and self.total is not None and throughput > 0:
+            eta = max(self.total - self.done, 0) / throughput
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "finished_at": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+            "done": self.done,
+            "total": self.total,
+            "progress": self.done / self.total if self.total else None,
+            "throughput_per_minute": round(throughput * 60, 2),
+            "eta_seconds": round(eta) if eta is not None else None,
+            "error": self.error,
+        }
+
+
+class JobRunner:
+    """
+    Runs a service's jobs on its BackgroundScheduler instead of blocking `__main__`,
+    so `/health` stays reachable, and serves:
+
+        GET  /jobs                  every job with its current and recent runs
+        GET  /jobs/<name>           one job
+        POST /jobs/<name>/run       start a run now, unless one is already running
+        POST /jobs/<name>/cancel    cancel the running run at its next progress update
+
+    Job functions are called with a `job` keyword argument to report progress on.
+    """
+
+    def __init__(self, app, scheduler, history=20):
+        self.scheduler = scheduler
+        self.jobs = {}
+        self.running = {}
+        self.history = {}
+        self.history_size = history
+        self.lock = threading.Lock()
+
+        app.add_url_rule("/jobs", "list_jobs", self.list_jobs)
+        app.add_url_rule("/jobs/<name>", "get_job", self.get_job)
+        app.add_url_rule("/jobs/<name>/run", "run_job", self.run_job, methods=["POST"])
+        app.add_url_rule("/jobs/<name>/cancel", "cancel_job", self.cancel_job, methods=["POST"])
+
+    def register(self, name, fn, **kwargs):
+        self.jobs[name] = (fn, kwargs)
+        self.history[name] = deque(maxlen=self.history_size)
+
+    def schedule(self, name, trigger, **trigger_args):
+        self.scheduler.add_job(self.run, trigger, args=[name], id=name, max_instances=1, coalesce=True, **trigger_args)
+
+    def trigger(self, name):
+        """Queues a run on the scheduler; returns False when one is already running."""
+        with self.lock:
+            if name in self.running:
+                return False
+        self.scheduler.add_job(self.run, args=[name], id=f"{name}-manual", max_instances=1, coalesce=True, replace_existing=True)
+        return True
+
+    def run(self, name):
+        fn, kwargs = self.jobs[name]
+        with self.lock:
+            if name in self.running:
+                print(f"[Jobs] {name} is already running, skipping")
+                return
+            job = self.running[name] = Job(name)
+        try:
+            fn(job=job, **kwargs)
+            job.status = "succeeded"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"[Jobs] {name} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            with self.lock:
+                del self.running[name]
+                self.history[name].appendleft(job)
+
+    def describe(self, name):
+        scheduled = self.scheduler.get_job(name)
+        with self.lock:
+            current = self.running.get(name)
+            recent = list(self.history[name])
+        return {
+            "name": name,
+            "next_run": scheduled.next_run_time.isoformat() if scheduled and scheduled.next_run_time else None,
+            "current": current.to_dict() if current else None,
+            "recent": [job.to_dict() for job in recent],
+        }
+
+    def list_jobs(self):
+        return jsonify([self.describe(name) for name in self.jobs])
+
+    def get_job(self, name):
+        if name not in self.jobs:
+            return jsonify({"error": f"Unknown job {name}"}), 404
+        return jsonify(self.describe(name))
+
+    def run_job(self, name):
+        if name not in self.jobs:
+            return jsonify({"error": f"Unknown job {name}"}), 404
+        if not self.trigger(name):
+            return jsonify({"error": f"{name} is already running"}), 409
+        return jsonify({"name": name, "status": "queued"}), 202
+
+    def cancel_job(self, name):
+        with self.lock:
+            job = self.running.get(name)
+        if job is None:
+            return jsonify({"error": f"{name} is not running"}), 409
+        job.cancelled.set()
+        return jsonify(job.to_dict())
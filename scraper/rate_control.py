@@ -0,0 +1,119 @@
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+
+
+class FetchError(Exception):
+    """A URL still failed after every retry."""
+
+
+class CircuitOpenError(Exception):
+    """Too many recent requests failed; the crawl should pause and retry the work later."""
+
+
+class AdaptiveFetcher:
+    """
+    Fetches pages from one site at a rate adjusted AIMD style: every fast
+    success raises the rate by `increase` requests per second, and every slow
+    response or failure multiplies it by `decrease`. Failed requests are retried
+    after a jittered exponential backoff. When at least `error_threshold` of the
+    last `window` requests failed, the circuit opens and every call raises
+    CircuitOpenError until `cooldown` seconds have passed.
+    """
+
+    def __init__(
+        self,
+        timeout=15,
+        initial_rate=1.0,
+        min_rate=0.1,
+        max_rate=5.0,
+        target_latency=3.0,
+        increase=0.1,
+        decrease=0.5,
+        base_backoff=1.0,
+        max_backoff=60.0,
+        window=20,
+        error_threshold=0.5,
+        cooldown=300,
+    ):
+        self.session = requests.Session()
+        self.timeout = timeout
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.outcomes = deque(maxlen=window)
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.next_request = 0.0
+        self.lock = threading.Lock()
+
+    def _wait_for_slot(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_request)
+            self.next_request = slot + 1 / self.rate
+        time.sleep(slot - now)
+
+    def _record(self, ok, latency=None):
+        with self.lock:
+            self.outcomes.append(ok)
+            if ok and latency <= self.target_latency:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            else:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.outcomes.maxlen // 2 and failures / len(self.outcomes) >= self.error_threshold:
+                if self.opened_at is None:
+                    print(f"[MOF Scraper] {failures} of the last {len(self.outcomes)} requests failed, pausing for {self.cooldown}s")
+                self.opened_at = time.monotonic()
+
+    def _check_circuit(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError()
+            # Half open: start over slowly and let the next requests decide
+            self.opened_at = None
+            self.outcomes.clear()
+            self.rate = self.min_rate
+
+    def wait_until_closed(self):
+        """Sleeps out the rest of the cooldown."""
+        with self.lock:
+            remaining = 0 if self.opened_at is None else self.cooldown - (time.monotonic() - self.opened_at)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def get(self, url, attempts=5):
+        """
+        Returns the response for `url`. Raises FetchError after `attempts` failures
+        and CircuitOpenError while the circuit is open.
+        """
+        for attempt in range(attempts):
+            self._check_circuit()
+            self._wait_for_slot()
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError(f"status {response.status_code}")
+            except requests.RequestException as e:
+                self._record(False)
+                backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+                print(f"[MOF Scraper] Request failed for {url} ({e}), retrying in {backoff:.1f}s...")
+                time.sleep(backoff)
+                continue
+            self._record(True, time.monotonic() - start)
+            return response
+        raise FetchError(url)
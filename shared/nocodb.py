@@ -0,0 +1,129 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Copied into the service directories from shared/ by shared/sync.py; edit shared/ and re-run it.
+
+
+class NocoRequestError(Exception):
+    pass
+
+
+def _request_with_retry(method, db_url, headers, label, retries=3, backoff=1.0, **kwargs):
+    for attempt in range(1, retries + 1):
+        try:
+            response = requests.request(method, db_url, headers=headers, timeout=60, **kwargs)
+            if response.status_code == 200:
+                return response
+            # 4xx other than rate limiting will not succeed on retry
+            if 400 <= response.status_code < 500 and response.status_code != 429:
+                raise NocoRequestError(f"HTTP {response.status_code} for {label}: {response.text}")
+            error = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            error = str(e)
+
+        print(f"⚠️ Request for {label} failed ({error}), attempt {attempt}/{retries}")
+        if attempt < retries:
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+    raise NocoRequestError(f"Giving up on {label} after {retries} attempts")
+
+
+def _get_page(db_url, headers, params, retries=3):
+    label = f"offset {params.get('offset')}"
+    response = _request_with_retry("GET", db_url, headers, label, retries, params=params)
+    try:
+        return response.json()
+    except ValueError as e:
+        raise NocoRequestError(f"Invalid JSON for {label}: {e}")
+
+
+def count_rows(db_url, headers, params):
+    data = _get_page(db_url, headers, {**params, "offset": 0, "limit": 1})
+    return data.get("pageInfo", {}).get("totalRows", 0)
+
+
+def fetch_rows(db_url, headers, params, page_size=100, max_records=50000, workers=8, retries=3):
+    """
+    Offset pagination with up to `workers` pages in flight. Reads totalRows first,
+    then yields rows in the same order a sequential walk would.
+    """
+    total = min(count_rows(db_url, headers, params), max_records)
+    offsets = iter(range(0, total, page_size))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+
+        def submit_next():
+            offset = next(offsets, None)
+            if offset is not None:
+                page_params = {**params, "offset": offset, "limit": min(page_size, total - offset)}
+                in_flight.append(executor.submit(_get_page, db_url, headers, page_params, retries))
+
+        # Keep a bounded window of pages ahead of the consumer
+        for _ in range(workers * 2):
+            submit_next()
+
+        while in_flight:
+            rows = in_flight.popleft().result().get("list", [])
+            submit_next()
+            yield from rows
+
+
+def fetch_rows_keyset(db_url, headers, params, page_size=100, max_records=50000, retries=3):
+    """
+    Keyset pagination on Id. Each page asks for rows after the last Id seen, so
+    deep pages cost the same as the first and inserts during the walk do not
+    shift later pages. Rows come back in Id order.
+    """
+    where = params.get("where")
+    fields = params.get("fields")
+    if fields and "Id" not in fields.split(","):
+        fields = "Id," + fields
+    last_id = 0
+    fetched = 0
+
+    while fetched < max_records:
+        id_filter = f"(Id,gt,{last_id})"
+        page_params = {
+            **params,
+            "fields": fields,
+            "where": f"({where})~and{id_filter}" if where else id_filter,
+            "sort": "Id",
+            "offset": 0,
+            "limit": min(page_size, max_records - fetched),
+        }
+        rows = _get_page(db_url, headers, page_params, retries).get("list", [])
+        if not rows:
+            break
+        yield from rows
+        last_id = rows[-1]["Id"]
+        fetched += len(rows)
+
+
+def patch_rows(db_url, headers, rows, batch_size=100, workers=4, retries=3):
+    """
+    Updates rows with list PATCHes of up to `batch_size` records, sending up to
+    `workers` batches at once. Each row must carry its Id. Returns a summary of
+    updated and failed rows.
+    """
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+    summary = {"rows": len(rows), "batches": len(batches), "updated": 0, "failed": 0}
+
+    def send(batch):
+        label = f"batch of {len(batch)} starting at Id {batch[0]['Id']}"
+        _request_with_retry("PATCH", db_url, headers, label, retries, json=batch)
+        return len(batch)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(batch, executor.submit(send, batch)) for batch in batches]
+        for batch, future in futures:
+            try:
+                summary["updated"] += future.result()
+            except NocoRequestError as e:
+                print(f"⚠️ {e}")
+                summary["failed"] += len(batch)
+
+    return summary
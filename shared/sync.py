@@ -0,0 +1,46 @@
+"""
+Copies the modules shared between services into each service directory. Every
+service is built from its own directory, so the copies are committed; run this
+after editing a module here, and `--check` in CI to catch copies that drifted.
+
+    python shared/sync.py [--check]
+"""
+import filecmp
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHARED_MODULES = {
+    "article_mirror.py": ["mirror", "scraper", "translator", "classifier", "rag", "grouping"],
+    "work_queue.py": ["scraper", "translator", "classifier"],
+    "job_runner.py": ["scraper", "translator", "classifier", "mirror"],
+    "nocodb.py": ["grouping", "rag"],
+}
+
+
+def main(check=False):
+    drifted = []
+    for module, services in SHARED_MODULES.items():
+        source = os.path.join(ROOT, "shared", module)
+        for service in services:
+            target = os.path.join(ROOT, service, module)
+            if os.path.exists(target) and filecmp.cmp(source, target, shallow=False):
+                continue
+            if check:
+                drifted.append(os.path.relpath(target, ROOT))
+            else:
+                shutil.copyfile(source, target)
+                print(f"Updated {os.path.relpath(target, ROOT)}")
+
+    if drifted:
+        print("Out of date with shared/, run `python shared/sync.py`:")
+        for path in drifted:
+            print(f"  {path}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(check="--check" in sys.argv[1:]))
@@ -1,11 +1,16 @@
-from flask import Flask
+from flask import Flask, jsonify
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime
 from dotenv import load_dotenv
 
 import os
+import re
+import threading
 import translator
 import requests
+from article_mirror import ArticleMirror
+from work_queue import CLASSIFY, TRANSLATE, WorkQueue
+from job_runner import JobRunner
 
 app = Flask(__name__)
 scheduler = BackgroundScheduler()
@@ -14,53 +19,194 @@ scheduler = BackgroundScheduler()
 def health_check():
     return "healthy"
 
-def translate():
+@app.route("/queue")
+def queue_status():
+    queue = WorkQueue.open()
+    if queue is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **queue.stats(TRANSLATE)})
+
+FIELDS = "Id,originalTitle,translatedTitle,originalContent,translatedContent,originalOutlet,translatedOutlet,isEnglish,contentTranslationDeferred"
+QUEUE_BATCH_SIZE = 10
+
+target_field = {
+    "originalTitle": "translatedTitle",
+    "originalContent": "translatedContent",
+    "originalOutlet": "translatedOutlet"
+}
+
+# "eager" translates every field up front. "lazy" translates titles and outlets up front and the
+# content only when the title looks relevant; other content is translated when requested at /translate/<id>.
+TRANSLATION_MODE = os.getenv("TRANSLATION_MODE", "eager")
+EAGER_FIELDS = ["originalTitle", "originalOutlet"]
+RELEVANT_TITLE = re.compile(r"loan|lend|credit|financ|debt|bank|fund|exim|贷款|融资|信贷|银行|借款|资金", re.IGNORECASE)
+
+def title_relevant(record):
+    title = " ".join([record.get("originalTitle") or "", record.get("translatedTitle") or ""])
+    return RELEVANT_TITLE.search(title) is not None
+
+def translate_fields(record, keys, translator_instance):
+    for key in keys:
+        if not record.get(key):
+            continue
+        sample_text = record.get(key).strip()[:100]
+        language = translator_instance.detect_lang_google(sample_text)
+        if language != "en" and language != "und":
+            # record[target_field[key]] = translator_instance.translate_text_deepl(record.get(key)).text
+            record[target_field[key]] = translator_instance.translate_text_google(record.get(key))
+
+            if not record.get(key) and record[target_field[key]] == None:
+                raise Exception("Translation failed")
+
+def save_record(record, mirror=None):
+    url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    if mirror:
+        mirror.write_through(url, headers, record)
+    else:
+        requests.patch(url, headers=headers, json=record)
+
+def translate_record(record, translator_instance, mirror=None):
+    if TRANSLATION_MODE == "lazy":
+        translate_fields(record, EAGER_FIELDS, translator_instance)
+        if title_relevant(record):
+            translate_fields(record, ["originalContent"], translator_instance)
+        else:
+            # Marks the record for /translate/<id>, so only deferred content is ever requested
+            record["contentTranslationDeferred"] = True
+            print(f"[MOF Translator] Deferred content translation for record {record.get('Id')}")
+    else:
+        translate_fields(record, [key for key in record.keys() if key in target_field.keys()], translator_instance)
+
+    record["isEnglish"] = True
+    save_record(record, mirror)
+    print(f"[MOF Translator] Translated record: {record.get('originalTitle')}\n to {record.get('translatedTitle')}\n")
+
+def fetch_records(ids, mirror=None):
+    if mirror:
+        return mirror.query(f"Id IN ({','.join('?' for _ in ids)})", ids, fields=FIELDS)
+    url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    params = {
+        "where": "~or".join(f"(Id,eq,{record_id})" for record_id in ids),
+        "fields": FIELDS,
+        "limit": len(ids),
+    }
+    return requests.get(url, headers=headers, params=params).json().get("list")
+
+@app.route("/translate/<int:record_id>", methods=["POST"])
+def translate_content(record_id):
+    """Translates a record's content on request, for records whose content translation was deferred."""
+    mirror = ArticleMirror.open()
+    records = fetch_records([record_id], mirror)
+    if len(records) == 0:
+        return jsonify({"error": f"Record {record_id} not found"}), 404
+    record = records[0]
+    if record.get("contentTranslationDeferred"):
+        translate_fields(record, ["originalContent"], translator.Translator())
+        # Saved even when the content turned out to be English, so it is not requested again
+        record["contentTranslationDeferred"] = False
+        save_record(record, mirror)
+    return jsonify({"Id": record_id, "translatedContent": record.get("translatedContent")})
+
+def translate(job=None):
     try:
         print("[MOF Translator] Translating started at " + datetime.now().isoformat() + "\n")
         url = os.getenv("NOCO_DB_URL")
         headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
-        params = {
-            "where": "(isEnglish,eq,false)~and(originalTitle,isnot,null)",
-            "fields": "Id,originalTitle,translatedTitle,originalContent,translatedContent,originalOutlet,translatedOutlet,isEnglish",
-            "limit": 500, # translate 10 records at a time
-        }
-        res = requests.get(url, headers=headers, params=params)
-        if res.json().get("pageInfo").get("totalRows") == 0:
+        mirror = ArticleMirror.open()
+        if mirror:
+            records = mirror.query("isEnglish = 0 AND originalTitle IS NOT NULL", limit=500, fields=FIELDS)
+        else:
+            params = {
+                "where": "(isEnglish,eq,false)~and(originalTitle,isnot,null)",
+                "fields": FIELDS,
+                "limit": 500, # translate 10 records at a time
+            }
+            records = requests.get(url, headers=headers, params=params).json().get("list")
+        if len(records) == 0:
             print("[MOF Translator] No records to translate\n")
             return
 
         translator_instance = translator.Translator()
-        target_field = {
-            "originalTitle": "translatedTitle",
-            "originalContent": "translatedContent",
-            "originalOutlet": "translatedOutlet"
-        }
-
-        for record in res.json().get("list"):
-            for key in record.keys():
-                if key in target_field.keys():
-                    if not record.get(key):
-                        continue
-                    sample_text = record.get(key).strip()[:100]
-                    language = translator_instance.detect_lang_google(sample_text)
-                    if language != "en" and language != "und":
-                        # record[target_field[key]] = translator_instance.translate_text_deepl(record.get(key)).text
-                        record[target_field[key]] = translator_instance.translate_text_google(record.get(key))
-
-                        if not record.get(key) and record[target_field[key]] == None:
-                            raise Exception("Translation failed")
-
-            record["isEnglish"] = True
-            requests.patch(url, headers=headers, json=record)
-            print(f"[MOF Translator] Translated record: {record.get('originalTitle')}\n to {record.get('translatedTitle')}\n")
+        if job:
+            job.set_total(len(records))
+        for record in records:
+            translate_record(record, translator_instance, mirror)
+            if job:
+                job.advance()
     except Exception as e:
         print(f"[MOF Translator] Error: {e}")
+        # Re-raised so the job runner records the run as failed
+        raise
+
+def fetch_untranslated_ids(mirror=None):
+    if mirror:
+        return [row["Id"] for row in mirror.query("isEnglish = 0 AND originalTitle IS NOT NULL", order="Id", fields="Id")]
+    url = os.getenv("NOCO_DB_URL")
+    headers = {"xc-token": os.getenv("NOCO_XC_TOKEN")}
+    ids = []
+    while True:
+        # Walked by Id, since the consumer translates records out of the filter while this runs
+        params = {
+            "where": f"(isEnglish,eq,false)~and(originalTitle,isnot,null)~and(Id,gt,{ids[-1] if ids else 0})",
+            "fields": "Id",
+            "sort": "Id",
+            "limit": 1000,
+        }
+        page = requests.get(url, headers=headers, params=params).json().get("list")
+        if not page:
+            return ids
+        ids.extend(row["Id"] for row in page)
+
+def publish_untranslated(job=None):
+    """
+    With the work queue enabled, queues the untranslated backlog for `consume`
+    instead of translating it here, so no record is translated twice at once.
+    """
+    queue = WorkQueue.open()
+    ids = fetch_untranslated_ids(ArticleMirror.open())
+    print(f"[MOF Translator] Queueing {len(ids)} untranslated records")
+    if job:
+        job.set_total(len(ids))
+    for start in range(0, len(ids), QUEUE_BATCH_SIZE):
+        batch = ids[start:start + QUEUE_BATCH_SIZE]
+        queue.publish(TRANSLATE, batch)
+        if job:
+            job.advance(len(batch))
+
+def consume(queue):
+    """Translates records as the scraper publishes them and hands them to the classifier."""
+    mirror = ArticleMirror.open()
+    translator_instance = translator.Translator()
+    while True:
+        jobs = queue.wait(TRANSLATE, QUEUE_BATCH_SIZE)
+        # Jobs left unacked, after an error or for records not found yet, are retried after the visibility timeout
+        try:
+            records = {record["Id"]: record for record in fetch_records([record_id for _, record_id in jobs], mirror)}
+            for job in jobs:
+                record = records.get(job[1])
+                if record is None:
+                    continue
+                if not record.get("isEnglish"):
+                    translate_record(record, translator_instance, mirror)
+                queue.publish(CLASSIFY, [record["Id"]])
+                queue.ack([job])
+        except Exception as e:
+            print(f"[MOF Translator] Error: {e}")
 
 
 if __name__ == "__main__":
     load_dotenv()
-    # scheduler.add_job(translate, "cron", hour="*", minute="*/5")
-    # scheduler.start()
-    translate()
+    runner = JobRunner(app, scheduler)
+    queue = WorkQueue.open()
+    # With the queue, `consume` does all the translating and the job only queues the backlog
+    runner.register("translate", publish_untranslated if queue else translate)
+    # runner.schedule("translate", "cron", hour="*", minute="*/5")
+    scheduler.start()
+    runner.trigger("translate")
+    if queue:
+        threading.Thread(target=consume, args=(queue,), daemon=True).start()
     print("[MOF Translator] Start translating")
-    app.run(port=5002)
\ No newline at end of file
+    # Listens on every interface so the classifier can call /translate/<id> from its container
+    app.run(host="0.0.0.0", port=5002)
\ No newline at end of file